@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import atexit
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import replace
+
+from playwright.async_api import async_playwright
+
+import qobuz_control
+import spotify_discover
+from qobuz_auth import login
+from qobuz_copy_discover import get_matcher, load_favorites_index, sync_tracks
+from qobuz_matcher import RATE_LIMIT
+from settings import load_settings
+
+# Per worker process state, set up by _init_worker
+_limiter = None
+_loop = None
+_browser = {}
+_browser_lock = None
+
+
+class SharedTokenBucket(object):
+    """Token bucket shared by every process of the pool.
+
+    Same interface as qobuz_matcher.TokenBucket, with its state held in
+    multiprocessing values so all workers draw from one Qobuz rate limit.
+
+    Parameters
+    ----------
+    rate: float
+        Tokens refilled per second. 0 or less disables limiting
+    capacity: float
+        Largest burst allowed
+    tokens, updated: multiprocessing.Value
+        Shared 'd' values holding the token count and last refill time
+    lock: multiprocessing.Lock
+        Lock guarding tokens and updated
+    """
+
+    def __init__(self, rate, capacity, tokens, updated, lock):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = tokens
+        self._updated = updated
+        self._lock = lock
+
+    def acquire(self):
+        """Block until a token is available and consume it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens.value = min(
+                    self.capacity,
+                    self._tokens.value + (now - self._updated.value) * self.rate
+                )
+                self._updated.value = now
+                if self._tokens.value >= 1:
+                    self._tokens.value -= 1
+                    return
+                wait = (1 - self._tokens.value) / self.rate
+            time.sleep(wait)
+
+
+def load_manifest(path):
+    """
+    Load the accounts manifest.
+
+    A JSON list of accounts, each with 'name', 'qobuz_user', 'qobuz_pass' and
+    'playlist_map' (a dict, or a SPOTIFY_PLAYLIST_MAP style string). Optional
+    keys: 'sync_playlist', the target playlist name with a {playlist}
+    placeholder, and 'remove_stale'.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        accounts = json.load(f)
+    names = [account["name"] for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError("Account names in the manifest must be unique")
+    return accounts
+
+
+def _init_worker(settings, rate, capacity, tokens, updated, lock, slots):
+    global _limiter, _loop, _browser_lock
+    if settings.profile_dir:
+        # Chromium locks a profile to one browser, every worker needs its own.
+        # Numbered rather than by pid, so the next run finds the same warm profiles
+        with lock:
+            slot = slots.value
+            slots.value += 1
+        settings = replace(settings, profile_dir=f"{settings.profile_dir}-{slot}")
+    # Spawned workers import spotify_discover afresh, with none of the parent's settings
+    spotify_discover.configure(settings)
+    _limiter = SharedTokenBucket(rate, capacity, tokens, updated, lock)
+    # One event loop per worker, so its browser stays usable across accounts
+    _loop = asyncio.new_event_loop()
+    _browser_lock = asyncio.Lock()
+    atexit.register(_close_worker)
+
+
+async def _get_browser():
+    """The worker's browser, launched on first use and kept for later accounts."""
+    # Playlists are scraped concurrently, only the first caller launches
+    async with _browser_lock:
+        if 'browser' not in _browser:
+            if 'playwright' not in _browser:
+                _browser['playwright'] = await async_playwright().start()
+            _browser['browser'] = await spotify_discover.launch_browser(_browser['playwright'])
+    return _browser['browser']
+
+
+async def _close_browser():
+    try:
+        if 'browser' in _browser:
+            await _browser.pop('browser').close()
+    finally:
+        if 'playwright' in _browser:
+            await _browser.pop('playwright').stop()
+
+
+def _close_worker():
+    """Close the worker's browser and Playwright driver when the worker exits."""
+    if _browser:
+        _loop.run_until_complete(_close_browser())
+
+
+def sync_account(account, settings):
+    """
+    Scrape and sync every playlist of one account, run inside a pool worker.
+
+    Returns
+    -------
+    tuple
+        (account name, {playlist name: summary dict})
+    """
+    name = account["name"]
+    playlist_map = account["playlist_map"]
+    if isinstance(playlist_map, str):
+        playlist_map = spotify_discover.parse_playlist_map(playlist_map)
+
+    client = spotify_discover.get_spotify_api_client() if settings.extraction_mode == 'api' else None
+    fetched = _loop.run_until_complete(spotify_discover.process_all_playlists(
+        playlist_map, client=client, output_prefix=f"{name}_", browser_factory=_get_browser
+    ))
+
+    user = login(account["qobuz_user"], account["qobuz_pass"], f".qobuz_credentials_{name}.json")
+    if user is None:
+        raise RuntimeError(f"Failed to log in to Qobuz as {account['qobuz_user']}")
+
+    matcher = get_matcher(settings)
+    # Every worker draws from the one rate limit shared by the pool
+    matcher.controller.limiter = _limiter
+    qobuz_control.set_controller(matcher.controller)
+    if settings.favorites_index:
+        # Favorites belong to the account, so does their index
+        root, ext = os.path.splitext(settings.favorites_index)
+        matcher.favorites = load_favorites_index(user, f"{root}_{name}{ext}", matcher.catalog)
+
+    summary = {}
+    target_template = account.get("sync_playlist", "Spotify {playlist}")
+    for playlist_name, tracks in fetched.items():
+        # Not str.format, braces in playlist names or the template must not raise
+        target = target_template.replace("{playlist}", playlist_name)
+        summary[playlist_name] = sync_tracks(
+            user, matcher, tracks, target=target, remove_stale=bool(account.get("remove_stale"))
+        )
+    for playlist_name in playlist_map:
+        summary.setdefault(playlist_name, {"error": "scrape failed"})
+    if matcher.cache is not None:
+        matcher.cache.close()
+    if matcher.catalog is not None:
+        matcher.catalog.close()
+    return name, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync Spotify playlists to Qobuz for many accounts at once.")
+    parser.add_argument("manifest", help="JSON list of accounts, see load_manifest")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Accounts synced in parallel")
+    parser.add_argument("--env", default=".env", help="Settings file, defaults to .env")
+    args = parser.parse_args()
+
+    accounts = load_manifest(args.manifest)
+    settings = load_settings(args.env)
+    rate = settings.match_rate if settings.match_rate is not None else RATE_LIMIT
+    capacity = max(1.0, rate)
+
+    # Workers must not inherit a forked asyncio loop or Playwright driver
+    ctx = multiprocessing.get_context("spawn")
+    tokens = ctx.Value("d", capacity, lock=False)
+    updated = ctx.Value("d", time.time(), lock=False)
+    lock = ctx.Lock()
+    slots = ctx.Value("i", 0, lock=False)
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(args.workers, len(accounts))),
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(settings, rate, capacity, tokens, updated, lock, slots),
+    ) as pool:
+        futures = {pool.submit(sync_account, account, settings): account["name"] for account in accounts}
+        for future in as_completed(futures):
+            try:
+                name, summary = future.result()
+            except Exception as e:
+                print(f"[{futures[future]}] failed: {qobuz_control.describe_error(e)}")
+                continue
+            for playlist_name, result in summary.items():
+                print(f"[{name}] {playlist_name}: {result}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import qobuz
+
+import qobuz_control
+import spotify_discover
+from qobuz_control import AdaptiveController
+from qobuz_matcher import QobuzMatcher, TokenBucket, MAX_WORKERS, RATE_LIMIT
+from qobuz_sync import add_tracks
+
+SIZES = (50, 1000, 10000)
+ARTISTS = 300  # distinct artists in the generated playlists
+
+
+def make_tracks(count, seed=0):
+    """Generated track records, every third one carries an ISRC."""
+    rng = random.Random(seed)
+    words = ["night", "drive", "summer", "echo", "gold", "river", "neon", "ghost", "fire", "blue"]
+    tracks = []
+    for i in range(count):
+        track = {
+            'track': f"{rng.choice(words).title()} {rng.choice(words).title()} {i}",
+            'artist': f"Artist {rng.randrange(ARTISTS)}",
+            'duration_ms': rng.randrange(120, 420) * 1000,
+        }
+        if i % 3 == 0:
+            track['isrc'] = f"QZBEN{i:07d}"
+        tracks.append(track)
+    return tracks
+
+
+def make_playlist_html(tracks):
+    """A page with the tracklist markup fetch_playlist_content and scrape_playlist_tracks expect."""
+    rows = []
+    for i, track in enumerate(tracks):
+        seconds = track['duration_ms'] // 1000
+        rows.append(
+            f'<div role="row" aria-rowindex="{i + 2}"><div data-testid="tracklist-row">'
+            f'<a data-testid="internal-track-link" href="/track/{i}"><div>{track["track"]}</div></a>'
+            f'<a href="/artist/{track["artist"].split()[-1]}">{track["artist"]}</a>'
+            f'<div>{seconds // 60}:{seconds % 60:02d}</div>'
+            f'</div></div>'
+        )
+    return (
+        '<!DOCTYPE html><html><body style="margin:0">'
+        '<div class="main-view-container" style="height:100vh;overflow-y:auto">'
+        f'<div role="grid" data-testid="playlist-tracklist" aria-rowcount="{len(tracks) + 1}">'
+        + "".join(rows) +
+        '</div></div></body></html>'
+    )
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections under concurrent matching,
+    # which shows up as one second SYN retransmits in the latencies
+    request_queue_size = 128
+
+
+def _server(handler):
+    server = _Server(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_fixtures(pages):
+    """Serve {path: html} from a local HTTP server, returns the server."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = pages.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return _server(Handler)
+
+
+class FakeQobuz(object):
+    """Stand-in for the Qobuz endpoints used by the matcher and the playlist writer.
+
+    Serves track/search (free text and ISRC), playlist/get and
+    playlist/addTracks for a generated catalog, with a fixed latency per
+    request, a random share of 503 answers, and a server side rate limit
+    answered with 429 and Retry-After.
+
+    Parameters
+    ----------
+    tracks: list of dict
+        Track records the catalog is built from
+    latency: float
+        Seconds added to every request
+    error_rate: float
+        Share of requests answered with 503
+    rate_limit: float
+        Requests per second accepted, 0 disables the limit
+    """
+
+    def __init__(self, tracks, latency=0.0, error_rate=0.0, rate_limit=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.limiter = TokenBucket(rate_limit) if rate_limit > 0 else None
+        self.requests = 0
+        self.rejected = 0
+        self.playlists = {}
+        self._lock = threading.Lock()
+        self._by_query = {}
+        self._by_isrc = {}
+        for i, track in enumerate(tracks):
+            item = self._item(i + 1, track)
+            self._by_query[f"{track['track']} {track['artist']}"] = item
+            if track.get('isrc'):
+                self._by_isrc[track['isrc']] = item
+
+    @staticmethod
+    def _item(track_id, track):
+        artist = {"id": track_id % ARTISTS, "name": track['artist']}
+        return {
+            "id": track_id, "title": track['track'], "duration": track['duration_ms'] // 1000,
+            "isrc": track.get('isrc'), "performer": artist,
+            "album": {"id": track_id, "title": "Album", "artist": artist,
+                      "maximum_bit_depth": 16, "maximum_sampling_rate": 44.1},
+        }
+
+    def _throttled(self):
+        # Non-blocking take, a client over the limit gets 429 instead of waiting
+        return self.limiter is not None and not self.limiter.try_acquire()
+
+    def handle(self, endpoint, params):
+        """Returns (status, payload)."""
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self._throttled():
+            status = 429
+        elif random.random() < self.error_rate:
+            status = 503
+        else:
+            status = None
+        if status is not None:
+            with self._lock:
+                self.rejected += 1
+            return status, {"status": "error"}
+        if endpoint == "track/search":
+            query = params.get("query", "")
+            item = self._by_isrc.get(query) or self._by_query.get(query)
+            return 200, {"tracks": {"items": [item] if item else [], "total": int(item is not None)}}
+        if endpoint == "playlist/get":
+            entries = self.playlists.get(params.get("playlist_id"), [])
+            offset = int(params.get("offset", 0))
+            limit = int(params.get("limit", 50))
+            items = [{"id": track_id, "playlist_track_id": n}
+                     for n, track_id in enumerate(entries[offset:offset + limit], offset)]
+            return 200, {"tracks": {"items": items, "total": len(entries)}}
+        if endpoint == "playlist/addTracks":
+            track_ids = [int(t) for t in params.get("track_ids", "").split(",") if t]
+            with self._lock:
+                self.playlists.setdefault(params.get("playlist_id"), []).extend(track_ids)
+            return 200, {"status": "success"}
+        return 404, {"status": "error"}
+
+    def serve(self):
+        """Start the HTTP server and point qobuz.api at it, returns the server."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                endpoint = url.path.split("/api.json/0.2/", 1)[-1]
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                status, payload = fake.handle(endpoint, params)
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "0.05")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = _server(Handler)
+        qobuz.api.API_URL = f"http://127.0.0.1:{server.server_address[1]}/api.json/0.2/"
+        qobuz.api.register_app("benchmark")
+        return server
+
+
+def _rss_bytes():
+    """Current resident set size of this process, from /proc when available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class Measure(object):
+    """Wall time and peak RSS of this process over a with block, sampled every 10ms."""
+
+    def __enter__(self):
+        self.peak = _rss_bytes()
+        self._done = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._started = time.perf_counter()
+        return self
+
+    def _sample(self):
+        while not self._done.wait(0.01):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._started
+        self._done.set()
+        self._sampler.join()
+        self.peak = max(self.peak, _rss_bytes())
+        return False
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+@contextlib.contextmanager
+def _quiet():
+    # The scraper prints every track, keep the report readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def bench_scrape(url, compact=True):
+    """Scrape with the in-page extraction, or with the full HTML and lxml when compact is False."""
+    async def scrape():
+        if compact:
+            return await spotify_discover.extract_playlist_tracks(url)
+        html = await spotify_discover.fetch_playlist_content(url)
+        return spotify_discover.scrape_playlist_tracks(html)
+
+    with _quiet(), Measure() as measure:
+        tracks = asyncio.run(scrape())
+    return measure, len(tracks), None
+
+
+def bench_parse(html):
+    with _quiet(), Measure() as measure:
+        tracks = spotify_discover.scrape_playlist_tracks(html)
+    return measure, len(tracks), None
+
+
+def bench_match(tracks, workers, client_rate):
+    controller = AdaptiveController(initial_limit=workers, max_limit=workers, limiter=TokenBucket(client_rate))
+    qobuz_control.set_controller(controller)
+    matcher = QobuzMatcher(max_workers=workers, controller=controller)
+    latencies = []
+    resolve = matcher.resolve
+
+    def timed_resolve(track):
+        started = time.perf_counter()
+        try:
+            return resolve(track)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    matcher.resolve = timed_resolve
+    with _quiet(), Measure() as measure:
+        matches, errors = matcher.match(tracks)
+    matched = [match for match in matches if match is not None]
+    return measure, len(matched), latencies, errors, controller.stats
+
+
+def bench_add(fake, matches, chunk_size):
+    playlist = qobuz.Playlist({"id": f"bench-{len(matches)}", "name": "Benchmark"})
+    user = qobuz.User.__new__(qobuz.User)
+    user.auth_token = "benchmark"
+    latencies = []
+    with Measure() as measure:
+        for start in range(0, len(matches), chunk_size):
+            chunk = matches[start:start + chunk_size]
+            started = time.perf_counter()
+            add_tracks(user, playlist, chunk, chunk_size)
+            latencies.append(time.perf_counter() - started)
+    stored = len(fake.playlists.get(playlist.id, []))
+    return measure, stored, latencies
+
+
+def _report(stage, size, count, measure, latencies=None, note=""):
+    rate = count / measure.seconds if measure.seconds else float("inf")
+    line = f"{stage:<6} {size:>6} rows  {count:>6} ok  {measure.seconds:8.2f}s  {rate:10.1f} tracks/s"
+    if latencies:
+        line += f"  p50 {_percentile(latencies, 0.5) * 1000:7.1f}ms  p99 {_percentile(latencies, 0.99) * 1000:7.1f}ms"
+    line += f"  peak RSS {measure.peak / 2 ** 20:7.1f} MiB"
+    if note:
+        line += f"  {note}"
+    print(line)
+    return {"stage": stage, "size": size, "ok": count, "seconds": measure.seconds, "tracks_per_sec": rate,
+            "p50": _percentile(latencies or [], 0.5), "p99": _percentile(latencies or [], 0.99),
+            "peak_rss": measure.peak}
+
+
+def main():
+    qobuz_control.set_request_timeout()
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for the scrape, match and add stages.")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="Playlist sizes, comma separated")
+    parser.add_argument("--stages", default="scrape,html,parse,match,add", help="Stages to run, comma separated")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every fake Qobuz request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake Qobuz requests failing with 503")
+    parser.add_argument("--server-rate", type=float, default=0.0, help="Requests/s the fake Qobuz accepts before 429, 0 for no limit")
+    parser.add_argument("--client-rate", type=float, default=0.0,
+                        help=f"Client side Qobuz rate limit, 0 (default) disables it, the real client uses {RATE_LIMIT}")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Match workers")
+    parser.add_argument("--chunk-size", type=int, default=50, help="Tracks per add request")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    stages = set(args.stages.split(","))
+    playlists = {size: make_tracks(size, seed=size) for size in sizes}
+    pages = {f"/playlist/{size}": make_playlist_html(tracks) for size, tracks in playlists.items()}
+    fixtures = serve_fixtures(pages)
+    fake = FakeQobuz(
+        [track for tracks in playlists.values() for track in tracks],
+        latency=args.latency, error_rate=args.error_rate, rate_limit=args.server_rate
+    )
+    api_server = fake.serve()
+
+    results = []
+    try:
+        for size in sizes:
+            tracks = playlists[size]
+            for stage in ("scrape", "html"):
+                if stage not in stages:
+                    continue
+                url = f"http://127.0.0.1:{fixtures.server_address[1]}/playlist/{size}"
+                try:
+                    measure, count, _ = bench_scrape(url, compact=stage == "scrape")
+                    results.append(_report(stage, size, count, measure))
+                except Exception as e:
+                    print(f"{stage:<6} {size:>6} rows  skipped: {e.__class__.__name__}: {str(e).splitlines()[0]}")
+            if "parse" in stages:
+                measure, count, _ = bench_parse(pages[f"/playlist/{size}"])
+                results.append(_report("parse", size, count, measure))
+            matched = []
+            if "match" in stages or "add" in stages:
+                measure, count, latencies, errors, stats = bench_match(tracks, args.workers, args.client_rate)
+                if "match" in stages:
+                    note = f"{len(errors)} errors, {stats['retries']} retries, {stats['congestion']} throttled"
+                    results.append(_report("match", size, count, measure, latencies, note))
+                matched = [qobuz.Track(fake._by_query[f"{t['track']} {t['artist']}"]) for t in tracks]
+            if "add" in stages:
+                measure, count, latencies = bench_add(fake, matched, args.chunk_size)
+                results.append(_report("add", size, count, measure, latencies, "per-chunk latency"))
+    finally:
+        fixtures.shutdown()
+        api_server.shutdown()
+
+    print(f"Fake Qobuz: {fake.requests} requests, {fake.rejected} rejected")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import heapq
+import json
+import sqlite3
+import threading
+
+from match_cache import CachedTrack
+from match_scoring import best_candidate
+from normalize import normalize_text
+
+DEFAULT_PATH = ".qobuz_catalog_index.sqlite"
+LOCAL_MIN_SCORE = 0.8  # weaker local hits are searched on Qobuz instead
+MAX_CANDIDATES = 50  # items scored per lookup, those sharing the most title and artist tokens
+
+
+def _compact(item):
+    """The fields of a Qobuz track item that scoring needs."""
+    album_artist = ((item.get("album") or {}).get("artist") or {}).get("name")
+    compact = {
+        "id": item["id"],
+        "title": item.get("title") or "",
+        "performer": {"name": (item.get("performer") or {}).get("name")},
+        "album": {"artist": {"name": album_artist}},
+        "duration": item.get("duration"),
+    }
+    if item.get("version"):
+        compact["version"] = item["version"]
+    if item.get("isrc"):
+        compact["isrc"] = item["isrc"].upper()
+    return compact
+
+
+def _item_tokens(item):
+    names = [item.get("title"), item.get("version"), item["performer"]["name"], item["album"]["artist"]["name"]]
+    return set(normalize_text(" ".join(n for n in names if n)).split())
+
+
+class CatalogIndex(object):
+    """Local inverted index of the Qobuz tracks seen so far.
+
+    Every track item returned by a search or read from the favorites is kept
+    on disk, and an in-memory index maps each normalized title and artist
+    token to the items containing it. A lookup intersects the postings of the
+    track title's tokens and scores the few items left with the same scoring
+    as a Qobuz search, so only confident hits skip the network. Adding is
+    incremental, items already indexed are skipped.
+
+    Parameters
+    ----------
+    path: str
+        SQLite database file
+    min_score: float
+        Score a local candidate needs to be returned
+    """
+
+    def __init__(self, path=DEFAULT_PATH, min_score=LOCAL_MIN_SCORE):
+        self.path = path
+        self.min_score = min_score
+        self._items = {}
+        self._postings = {}
+        self._isrcs = {}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, item TEXT NOT NULL)")
+        self._db.commit()
+        for (payload,) in self._db.execute("SELECT item FROM items"):
+            self._index(json.loads(payload))
+
+    def __len__(self):
+        return len(self._items)
+
+    def _index(self, item):
+        self._items[item["id"]] = item
+        for token in _item_tokens(item):
+            self._postings.setdefault(token, set()).add(item["id"])
+        if item.get("isrc"):
+            self._isrcs[item["isrc"]] = item["id"]
+
+    def add_many(self, items):
+        """Index raw Qobuz track items, returns the number that were new."""
+        new = [_compact(item) for item in items if item and item.get("id") is not None]
+        with self._lock:
+            new = [item for item in new if item["id"] not in self._items]
+            if not new:
+                return 0
+            for item in new:
+                self._index(item)
+            self._db.executemany(
+                "INSERT OR IGNORE INTO items VALUES (?, ?)",
+                [(item["id"], json.dumps(item, ensure_ascii=False, separators=(",", ":"))) for item in new]
+            )
+            self._db.commit()
+        return len(new)
+
+    def add(self, item):
+        return self.add_many([item])
+
+    def lookup(self, track):
+        """
+        Find a confident local match for a Spotify track record.
+
+        An exact ISRC is a hit on its own, otherwise every title token must
+        match and the best candidate must score min_score. Returns a
+        CachedTrack or None.
+        """
+        with self._lock:
+            isrc = (track.get('isrc') or "").upper()
+            if isrc in self._isrcs:
+                item = self._items[self._isrcs[isrc]]
+                return CachedTrack(item["id"], item["title"])
+            tokens = normalize_text(track['track']).split()
+            if not tokens:
+                return None
+            # Rarest token first, so the intersection shrinks as fast as possible
+            postings = sorted((self._postings.get(token, ()) for token in tokens), key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                if not candidates:
+                    break
+                candidates &= posting
+            if len(candidates) > MAX_CANDIDATES:
+                # Common titles match many items, keep the ones that also share artist tokens
+                wanted = set(tokens) | set(normalize_text(track['artist']).split())
+                candidates = heapq.nlargest(
+                    MAX_CANDIDATES, candidates, key=lambda item_id: len(wanted & _item_tokens(self._items[item_id]))
+                )
+            items = [self._items[item_id] for item_id in candidates]
+        item, _ = best_candidate(track, items, self.min_score)
+        if item is None:
+            return None
+        return CachedTrack(item["id"], item["title"])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
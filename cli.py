@@ -0,0 +1,247 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+from settings import load_settings
+
+# Modules each command needs, imported inside the command so that light
+# commands never load spotipy, lxml, Playwright or requests
+COMMAND_IMPORTS = {
+    "cache": ["match_cache"],
+    "match": ["qobuz_copy_discover"],
+    "sync": ["qobuz_copy_discover"],
+    "scrape": ["spotify_discover"],
+    "daemon": ["daemon"],
+}
+LIGHT_COMMANDS = ("cache",)
+HEAVY_MODULES = ("spotipy", "playwright", "lxml", "requests", "qobuz")
+IMPORT_BUDGET_MS = 50.0  # import cost allowed for the light commands, on top of a bare interpreter
+IMPORT_RUNS = 5  # fresh interpreters per measurement, the fastest one counts
+
+
+def _login(settings):
+    from qobuz_auth import login
+
+    if not settings.has_qobuz_credentials:
+        print("No Qobuz credentials found in .env file. Please set QOBUZ_USER and QOBUZ_PASS.")
+        return None
+    user = login(settings.qobuz_user, settings.qobuz_pass, settings.credentials_cache)
+    if user is None:
+        print("Failed to log in to Qobuz.")
+    return user
+
+
+def _export_trace(settings):
+    import tracing
+
+    tracing.export(settings.trace_jsonl, settings.trace_prometheus)
+
+
+def _matcher(settings, user):
+    import qobuz_control
+    from qobuz_copy_discover import get_matcher, load_favorites_index
+
+    matcher = get_matcher(settings)
+    qobuz_control.set_controller(matcher.controller)
+    if settings.favorites_index:
+        matcher.favorites = load_favorites_index(user, settings.favorites_index, matcher.catalog)
+    return matcher
+
+
+def _load_tracks(settings, path, new_only):
+    from qobuz_copy_discover import load_new_spotify_tracks, load_spotify_tracks
+
+    if new_only:
+        return load_new_spotify_tracks(settings.snapshot_db)
+    return load_spotify_tracks(path)
+
+
+def cmd_scrape(settings, args):
+    import asyncio
+    import spotify_discover
+
+    spotify_discover.configure(settings)
+    playlist_map = settings.playlist_map
+    if args.playlist:
+        missing = [name for name in args.playlist if name not in playlist_map]
+        if missing:
+            print(f"Not in SPOTIFY_PLAYLIST_MAP: {', '.join(missing)}")
+            return 1
+        playlist_map = {name: playlist_map[name] for name in args.playlist}
+    if not playlist_map:
+        print("No playlists configured. Please set SPOTIFY_PLAYLIST_MAP.")
+        return 1
+    client = spotify_discover.get_spotify_api_client() if settings.extraction_mode == 'api' else None
+    fetched = asyncio.run(spotify_discover.process_all_playlists(playlist_map, client=client))
+    _export_trace(settings)
+    return 0 if len(fetched) == len(playlist_map) else 1
+
+
+def cmd_match(settings, args):
+    from qobuz_copy_discover import print_match_errors
+
+    user = _login(settings)
+    if user is None:
+        return 1
+    tracks = _load_tracks(settings, args.input, args.new_only)
+    matches, errors = _matcher(settings, user).match(tracks)
+    print_match_errors(errors)
+    print(f"Matched {sum(match is not None for match in matches)} of {len(tracks)} tracks.")
+    if args.output:
+        records = [
+            dict(track, qobuz_id=match.id if match else None, qobuz_title=match.title if match else None)
+            for track, match in zip(tracks, matches)
+        ]
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False, indent=2)
+        print(f"Saved {len(records)} matches to {args.output}")
+    _export_trace(settings)
+    return 0
+
+
+def cmd_sync(settings, args):
+    from qobuz_copy_discover import sync_tracks
+
+    user = _login(settings)
+    if user is None:
+        return 1
+    new_only = args.new_only or settings.new_tracks_only
+    tracks = _load_tracks(settings, args.input, new_only)
+    summary = sync_tracks(
+        user, _matcher(settings, user), tracks, target=args.target or settings.sync_playlist,
+        remove_stale=settings.remove_stale, new_only=new_only
+    )
+    _export_trace(settings)
+    return 1 if "error" in summary else 0
+
+
+def cmd_cache(settings, args):
+    from match_cache import MatchCache
+
+    if not settings.match_cache:
+        print("The match cache is disabled (QOBUZ_MATCH_CACHE is empty).")
+        return 1
+    if not os.path.exists(settings.match_cache):
+        # Opening it would create an empty database
+        print(f"No match cache at {settings.match_cache} yet, run a match or sync first.")
+        return 1
+    cache = MatchCache(settings.match_cache)
+    try:
+        rows = cache.entries(limit=args.limit, search=args.search)
+    finally:
+        cache.close()
+    for title, artist, qobuz_id, qobuz_title, last_used in rows:
+        used = datetime.datetime.fromtimestamp(last_used).strftime("%Y-%m-%d %H:%M")
+        found = f"{qobuz_id} {qobuz_title}" if qobuz_id is not None else "not found"
+        print(f"{used}  {title} - {artist}  ->  {found}")
+    return 0
+
+
+def cmd_daemon(settings, args):
+    import daemon
+
+    daemon.main(settings)
+    return 0
+
+
+def _import_ms(modules, runs=IMPORT_RUNS):
+    """
+    Import time in ms of modules in a fresh interpreter, and the set of modules it loaded.
+
+    The fastest of runs interpreters is kept, a single run is too noisy for a budget.
+    """
+    code = "; ".join(f"import {module}" for module in modules) or "pass"
+    best = None
+    loaded = set()
+    for _ in range(max(1, runs)):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True, text=True, check=True,
+            # The modules are found next to cli.py, whatever the working directory
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        total = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if not cumulative.strip().isdigit():
+                continue  # header line
+            loaded.add(name.strip())
+            if not name.startswith("  "):
+                total += int(cumulative)  # top-level import, nested ones are part of it
+        best = total if best is None else min(best, total)
+    return best / 1000.0, loaded
+
+
+def cmd_import_time(settings, args):
+    baseline, _ = _import_ms([], args.runs)
+    failed = False
+    for command in ["cli", *COMMAND_IMPORTS]:
+        modules = ["cli"] if command == "cli" else ["cli", *COMMAND_IMPORTS[command]]
+        ms, loaded = _import_ms(modules, args.runs)
+        ms = max(0.0, ms - baseline)
+        line = f"{command:<8} {ms:8.1f} ms"
+        if command == "cli" or command in LIGHT_COMMANDS:
+            heavy = sorted(module for module in HEAVY_MODULES if module in loaded)
+            if heavy:
+                line += f"  REGRESSION: imports {', '.join(heavy)}"
+                failed = True
+            if ms > args.budget_ms:
+                line += f"  REGRESSION: over the {args.budget_ms:.0f} ms budget"
+                failed = True
+        print(line)
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Copy Spotify playlists to Qobuz.")
+    parser.add_argument("--env", default=".env", help="Settings file, defaults to .env")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scrape = commands.add_parser("scrape", help="Fetch SPOTIFY_PLAYLIST_MAP playlists into <name>_tracks.json")
+    scrape.add_argument("playlist", nargs="*", help="Playlist names, all of them by default")
+    scrape.set_defaults(func=cmd_scrape)
+
+    for name, func, help_text in (
+        ("match", cmd_match, "Match a tracks JSON file against Qobuz"),
+        ("sync", cmd_sync, "Sync a tracks JSON file into a Qobuz playlist, without scraping"),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("input", nargs="?", default="discover_weekly_tracks.json", help="Tracks JSON file")
+        command.add_argument("--new-only", action="store_true",
+                             help="Use the tracks of the latest snapshot that are new since earlier weeks")
+        command.set_defaults(func=func)
+        if name == "match":
+            command.add_argument("--output", help="Write the tracks with their Qobuz match to this JSON file")
+        else:
+            command.add_argument("--target", help="Playlist name or ID to sync, defaults to QOBUZ_SYNC_PLAYLIST")
+
+    cache = commands.add_parser("cache", help="Show cached matches, most recently used first")
+    cache.add_argument("--limit", type=int, default=20, help="Entries shown, 0 for all")
+    cache.add_argument("--search", help="Only titles or artists containing this normalized text")
+    cache.set_defaults(func=cmd_cache)
+
+    daemon = commands.add_parser("daemon", help="Run the scheduled sync daemon")
+    daemon.set_defaults(func=cmd_daemon)
+
+    import_time = commands.add_parser("import-time", help="Measure the import cost of every command")
+    import_time.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS,
+                             help="Import time allowed for the light commands")
+    import_time.add_argument("--runs", type=int, default=IMPORT_RUNS,
+                             help="Interpreters started per command, the fastest one is measured")
+    import_time.set_defaults(func=cmd_import_time)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    settings = load_settings(args.env)
+    return args.func(settings, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import asyncio
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import schedule
+from playwright.async_api import async_playwright
+
+import qobuz_control
+import spotify_discover
+import tracing
+from qobuz_auth import login, session_is_valid
+from qobuz_copy_discover import get_matcher, load_favorites_index, sync_tracks
+from settings import load_settings
+
+DEFAULT_PORT = 8765
+DEFAULT_SYNC_TIME = "09:00"  # Monday, local time, Discover Weekly refreshes overnight
+DEFAULT_PLAYLIST_TEMPLATE = "Spotify {playlist}"  # Qobuz playlist name, {playlist} is the Spotify playlist name
+
+
+class SyncDaemon(object):
+    """Long-running sync service that keeps its expensive state warm.
+
+    The Playwright browser lives on a private event loop thread, and the
+    Qobuz session and matcher (with its caches) are reused across runs.
+    Runs are serialized on one worker thread, whether they come from the
+    weekly schedule or from the local HTTP endpoint.
+
+    Parameters
+    ----------
+    settings: settings.Settings
+        Configuration, spotify_discover must already be configured with it
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.user = None
+        self.matcher = None
+        self.client = spotify_discover.get_spotify_api_client() if settings.extraction_mode == 'api' else None
+        self.status = {"running": False, "last_run": None}
+        self._jobs = queue.Queue()
+        self._loop = asyncio.new_event_loop()
+        self._playwright = None
+        self._browser = None
+        self._browser_lock = asyncio.Lock()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        threading.Thread(target=self._work, daemon=True).start()
+
+    async def _get_browser(self):
+        # Playlists are scraped concurrently, only the first caller launches
+        async with self._browser_lock:
+            if self._browser is not None and getattr(self._browser, "is_connected", lambda: True)():
+                return self._browser
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await spotify_discover.launch_browser(self._playwright)
+            return self._browser
+
+    def _get_user(self):
+        if self.user is None or not session_is_valid(self.user):
+            self.user = login(self.settings.qobuz_user, self.settings.qobuz_pass, self.settings.credentials_cache)
+            if self.user is None:
+                raise RuntimeError("Failed to log in to Qobuz.")
+        return self.user
+
+    def trigger(self, reason):
+        """Queue a sync run, returns at once."""
+        self._jobs.put(reason)
+
+    def _work(self):
+        while True:
+            reason = self._jobs.get()
+            started = time.time()
+            self.status["running"] = True
+            try:
+                result = self.run_sync()
+                error = None
+            except Exception as e:
+                result = None
+                # Shown on /status, request URLs must not carry the token there
+                error = qobuz_control.describe_error(e)
+                print(f"Sync failed: {error}")
+            tracing.export(self.settings.trace_jsonl, self.settings.trace_prometheus)
+            self.status["running"] = False
+            self.status["last_run"] = {
+                "reason": reason,
+                "started": datetime.datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+                "seconds": round(time.time() - started, 2),
+                "result": result,
+                "error": error,
+            }
+
+    def _synced_weeks(self):
+        """{playlist name: Discover Weekly date of its last successful sync}"""
+        path = self.settings.daemon_state
+        if not path or not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f).get("synced", {})
+        except (OSError, ValueError):
+            return {}
+
+    def _mark_synced(self, name, week):
+        path = self.settings.daemon_state
+        if not path:
+            return
+        synced = self._synced_weeks()
+        synced[name] = week
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"synced": synced}, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def run_sync(self):
+        """Scrape every mapped playlist and sync it into its Qobuz playlist."""
+        week = spotify_discover.get_discover_weekly_date()
+        future = asyncio.run_coroutine_threadsafe(
+            spotify_discover.process_all_playlists(
+                self.settings.playlist_map, client=self.client, browser_factory=self._get_browser
+            ),
+            self._loop
+        )
+        fetched = future.result()
+
+        user = self._get_user()
+        if self.matcher is None:
+            self.matcher = get_matcher(self.settings)
+            qobuz_control.set_controller(self.matcher.controller)
+        if self.settings.favorites_index:
+            self.matcher.favorites = load_favorites_index(user, self.settings.favorites_index, self.matcher.catalog)
+
+        template = self.settings.daemon_playlist_template or DEFAULT_PLAYLIST_TEMPLATE
+        result = {}
+        for name, tracks in fetched.items():
+            # Not str.format, braces in playlist names or the template must not raise
+            target = template.replace("{playlist}", name)
+            result[name] = sync_tracks(
+                user, self.matcher, tracks, target=target, remove_stale=self.settings.remove_stale
+            )
+            if "error" not in result[name]:
+                self._mark_synced(name, week)
+        return result
+
+    def this_week_is_synced(self):
+        """
+        True when every mapped playlist was synced for the current Discover Weekly date.
+
+        Read from the state file written after each successful sync, not from
+        the snapshots, which are saved before matching and by manual scrapes.
+        """
+        week = spotify_discover.get_discover_weekly_date()
+        synced = self._synced_weeks()
+        return all(synced.get(name) == week for name in self.settings.playlist_map)
+
+
+def make_handler(daemon):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/status":
+                status = dict(daemon.status, queued=daemon._jobs.qsize())
+                next_run = schedule.next_run()
+                status["next_run"] = next_run.isoformat(timespec="seconds") if next_run else None
+                self._reply(200, status)
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path == "/sync":
+                daemon.trigger("http")
+                self._reply(202, {"queued": True})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main(settings=None):
+    """Run the daemon until interrupted, with the .env settings unless settings is given."""
+    if settings is None:
+        settings = load_settings()
+    if not settings.has_qobuz_credentials:
+        print("No Qobuz credentials found in .env file. Please set QOBUZ_USER and QOBUZ_PASS.")
+        return
+    spotify_discover.configure(settings)
+    daemon = SyncDaemon(settings)
+
+    sync_time = settings.daemon_sync_time or DEFAULT_SYNC_TIME
+    schedule.every().monday.at(sync_time).do(daemon.trigger, "schedule")
+    # Catch up when the daemon was down over the weekly refresh
+    if not daemon.this_week_is_synced():
+        daemon.trigger("startup")
+
+    port = settings.daemon_port or DEFAULT_PORT
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(daemon))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Daemon running: weekly sync Mondays at {sync_time}, POST http://127.0.0.1:{port}/sync to sync now.")
+
+    try:
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+
+from match_cache import CachedTrack
+from normalize import normalize_text, split_artists
+
+DEFAULT_PATH = ".qobuz_favorites_index.json"
+
+
+class FavoritesIndex(object):
+    """Compact local index of the user's favorite Qobuz tracks.
+
+    Maps a normalized title to [track_id, title, normalized artist] entries so
+    the matcher can resolve tracks the user already has without searching.
+
+    Parameters
+    ----------
+    path: str
+        JSON file the index is stored in
+    load: bool
+        Read the existing file, False starts an empty index that replaces it on save
+    """
+
+    def __init__(self, path=DEFAULT_PATH, load=True):
+        self.path = path
+        self._titles = {}
+        self._ids = set()
+        self._lock = threading.Lock()
+        if load and path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._titles = json.load(f)
+            self._ids = {entry[0] for entries in self._titles.values() for entry in entries}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, track_id):
+        return track_id in self._ids
+
+    def add(self, item):
+        """Add a raw favorite track item, as returned by favorite/getUserFavorites."""
+        track_id = item.get("id")
+        title = item.get("title")
+        if track_id is None or not title:
+            return
+        artist = (item.get("performer") or {}).get("name") \
+            or ((item.get("album") or {}).get("artist") or {}).get("name") or ""
+        with self._lock:
+            if track_id in self._ids:
+                return
+            self._ids.add(track_id)
+            self._titles.setdefault(normalize_text(title), []).append(
+                [track_id, title, normalize_text(artist)]
+            )
+
+    def lookup(self, track):
+        """
+        Find a favorite matching a Spotify track record.
+
+        The normalized title must match and the first credited Spotify artist
+        must be the favorite's artist. Returns a CachedTrack or None.
+        """
+        artists = split_artists(track['artist'])
+        if not artists:
+            return None
+        artist = normalize_text(artists[0])
+        for track_id, title, fav_artist in self._titles.get(normalize_text(track['track']), []):
+            if fav_artist == artist:
+                return CachedTrack(track_id, title)
+        return None
+
+    def save(self):
+        with self._lock:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self._titles, f, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,148 @@
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from normalize import track_key
+
+DEFAULT_PATH = ".qobuz_match_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 3600  # seconds before a "not found" is searched again
+
+# Stand-in for qobuz.Track on cache hits, playlist.add_tracks only needs the id
+CachedTrack = namedtuple('CachedTrack', ['id', 'title'])
+
+
+class MatchCache(object):
+    """On-disk cache of Spotify track -> Qobuz track ID matches.
+
+    Entries are keyed by the normalized (track, artist) pair. Tracks that
+    were not found on Qobuz are cached too, but expire after negative_ttl
+    seconds. The least recently used entries are evicted once the cache
+    grows past max_entries.
+
+    Parameters
+    ----------
+    path: str
+        SQLite database file
+    max_entries: int
+        Number of entries kept, 0 disables eviction
+    negative_ttl: float
+        Seconds a negative result stays valid
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL lets several processes (see batch_sync.py) share one cache file
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS matches (
+                title TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                qobuz_id INTEGER,
+                qobuz_title TEXT,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (title, artist)
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS matches_last_used ON matches (last_used)")
+        self._db.commit()
+
+    def get(self, track):
+        """
+        Look up a track record.
+
+        Returns
+        -------
+        tuple
+            (hit, match) where match is a CachedTrack, or None for a cached
+            "not found". hit is False when Qobuz has to be searched.
+        """
+        title, artist = track_key(track)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT qobuz_id, qobuz_title, created_at FROM matches WHERE title = ? AND artist = ?",
+                (title, artist)
+            ).fetchone()
+            if row is None or (row[0] is None and now - row[2] > self.negative_ttl):
+                self.misses += 1
+                return False, None
+            self._db.execute(
+                "UPDATE matches SET last_used = ? WHERE title = ? AND artist = ?",
+                (now, title, artist)
+            )
+            self._db.commit()
+            self.hits += 1
+        if row[0] is None:
+            return True, None
+        return True, CachedTrack(row[0], row[1])
+
+    def put(self, track, match):
+        """Store the Qobuz track matched for a track record, or None if not found."""
+        title, artist = track_key(track)
+        now = time.time()
+        qobuz_id = match.id if match is not None else None
+        qobuz_title = match.title if match is not None else None
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?, ?, ?)",
+                (title, artist, qobuz_id, qobuz_title, now, now)
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        count = self._db.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM matches WHERE rowid IN "
+                "(SELECT rowid FROM matches ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def entries(self, limit=None, search=None):
+        """
+        Cached matches, most recently used first.
+
+        Parameters
+        ----------
+        limit: int, optional
+            Number of entries returned
+        search: str, optional
+            Only entries whose normalized title or artist contains it
+
+        Returns
+        -------
+        list of tuple
+            (title, artist, qobuz_id, qobuz_title, last_used), qobuz_id is
+            None for a cached "not found"
+        """
+        query = "SELECT title, artist, qobuz_id, qobuz_title, last_used FROM matches"
+        params = []
+        if search:
+            query += " WHERE title LIKE ? OR artist LIKE ?"
+            params += [f"%{search}%"] * 2
+        query += " ORDER BY last_used DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,128 @@
+from difflib import SequenceMatcher
+
+from normalize import normalize_text, split_artists
+
+# Feature weights, the duration weight is dropped when either side has no duration
+TITLE_WEIGHT = 0.5
+ARTIST_WEIGHT = 0.35
+DURATION_WEIGHT = 0.15
+DURATION_TOLERANCE = 30.0  # seconds of difference that score 0
+MIN_SCORE = 0.55  # below this the best candidate is rejected, candidates without an artist match score 0
+TIE_MARGIN = 0.02  # candidates this close to the best go to the second stage
+
+
+def _tokens(text):
+    return set(normalize_text(text).split())
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _candidate_title(item):
+    title = item.get('title') or ""
+    if item.get('version'):
+        title = f"{title} {item['version']}"
+    return title
+
+
+def _candidate_artists(item):
+    names = [
+        (item.get('performer') or {}).get('name'),
+        ((item.get('album') or {}).get('artist') or {}).get('name'),
+        (item.get('composer') or {}).get('name'),
+    ]
+    # Padded so artists are matched on word boundaries
+    return f" {normalize_text(' '.join(n for n in names if n))} "
+
+
+def score_candidates(track, items):
+    """
+    Score Qobuz search results against one Spotify track record.
+
+    Each feature is computed for all candidates in one pass, then the columns
+    are combined with the feature weights.
+
+    Parameters
+    ----------
+    track: dict
+        Spotify track record with 'track', 'artist' and optionally 'duration_ms'
+    items: list of dict
+        Raw track items from the Qobuz track/search response
+
+    Returns
+    -------
+    list of float
+        Score in [0, 1] for each item
+    """
+    if not items:
+        return []
+    title_tokens = _tokens(track['track'])
+    artists = [normalize_text(a) for a in split_artists(track['artist'])]
+    duration = (track.get('duration_ms') or 0) / 1000.0
+
+    title_scores = [_jaccard(title_tokens, _tokens(_candidate_title(item))) for item in items]
+
+    candidate_artists = [_candidate_artists(item) for item in items]
+    if artists:
+        # The first credited artist counts as much as all the others together
+        weights = [1.0]
+        if len(artists) > 1:
+            weights += [1.0 / (len(artists) - 1)] * (len(artists) - 1)
+        total_weight = sum(weights)
+        artist_scores = [
+            sum(w for a, w in zip(artists, weights) if a and f" {a} " in text) / total_weight
+            for text in candidate_artists
+        ]
+    else:
+        artist_scores = [0.0] * len(items)
+
+    durations = [item.get('duration') or 0 for item in items]
+    if duration:
+        duration_scores = [
+            max(0.0, 1.0 - abs(d - duration) / DURATION_TOLERANCE) if d else None
+            for d in durations
+        ]
+    else:
+        duration_scores = [None] * len(items)
+
+    scores = []
+    for t, a, d in zip(title_scores, artist_scores, duration_scores):
+        if artists and not a:
+            # None of the credited artists: same title and length is a cover or a namesake
+            scores.append(0.0)
+        elif d is None:
+            scores.append((TITLE_WEIGHT * t + ARTIST_WEIGHT * a) / (TITLE_WEIGHT + ARTIST_WEIGHT))
+        else:
+            scores.append(TITLE_WEIGHT * t + ARTIST_WEIGHT * a + DURATION_WEIGHT * d)
+    return scores
+
+
+def _tie_break(track, item):
+    """Second stage: character-level similarity of the full title and artist strings."""
+    query = normalize_text(f"{track['track']} {track['artist']}")
+    candidate = normalize_text(f"{_candidate_title(item)} {_candidate_artists(item)}")
+    return SequenceMatcher(None, query, candidate).ratio()
+
+
+def best_candidate(track, items, min_score=MIN_SCORE):
+    """
+    Pick the best Qobuz search result for a track record.
+
+    Returns
+    -------
+    tuple
+        (item, score), item is None when no candidate reaches min_score
+    """
+    scores = score_candidates(track, items)
+    if not scores:
+        return None, 0.0
+    top = max(scores)
+    if top < min_score:
+        return None, top
+    tied = [item for item, score in zip(items, scores) if top - score <= TIE_MARGIN]
+    if len(tied) == 1:
+        return tied[0], top
+    return max(tied, key=lambda item: _tie_break(track, item)), top
@@ -0,0 +1,30 @@
+import re
+import unicodedata
+
+_FEAT_REGEX = re.compile(r'[\(\[]\s*(feat\.?|ft\.?|featuring|with)\s[^\)\]]*[\)\]]', re.IGNORECASE)
+_NON_WORD_REGEX = re.compile(r'[^\w]+')
+
+
+def normalize_text(text):
+    """
+    Normalize a title or artist name for matching and cache keys.
+
+    Lowercases, strips accents, drops "(feat. ...)" credits and collapses
+    punctuation and whitespace to single spaces.
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize('NFKD', text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = _FEAT_REGEX.sub(' ', text.lower())
+    return _NON_WORD_REGEX.sub(' ', text).strip()
+
+
+def split_artists(artist):
+    """Split the ", " joined artist string written by spotify_discover.py."""
+    return [a.strip() for a in (artist or "").split(',') if a.strip()]
+
+
+def track_key(track):
+    """Normalized (title, artist) key for a Spotify track record."""
+    return normalize_text(track['track']), normalize_text(track['artist'])
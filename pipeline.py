@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+
+import qobuz_control
+import spotify_discover
+import tracing
+from qobuz_auth import login
+from qobuz_copy_discover import find_or_create_playlist, get_matcher, load_favorites_index, print_match_errors
+from qobuz_sync import add_tracks, get_playlist_entries
+from settings import load_settings
+
+QUEUE_SIZE = 200  # tracks waiting between two stages before the producer is paused
+BATCH_SIZE = 50  # tracks per playlist.add_tracks call
+PROGRESS_INTERVAL = 2.0  # seconds between progress lines
+
+_DONE = object()
+
+
+async def run_pipeline(produce, matcher, add_batch, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+    """
+    Run scrape, match and add as overlapping stages connected by bounded queues.
+
+    Scraped tracks are matched while scraping continues, and matched tracks are
+    added in batches while matching continues. Full queues pause the stage
+    feeding them. Tracks are added in playlist order.
+
+    Parameters
+    ----------
+    produce: coroutine function
+        Called with an on_tracks coroutine function, which it awaits with each
+        list of newly scraped tracks
+    matcher: QobuzMatcher
+        Resolves tracks, matcher.max_workers matchers consume the queue
+    add_batch: function
+        Called in a worker thread with each list of matched Qobuz tracks,
+        returns how many it added
+    batch_size: int
+        Tracks per add_batch call
+    queue_size: int
+        Capacity of each queue
+
+    Returns
+    -------
+    tuple
+        (stats, scraped, errors): per stage counters, every scraped track in
+        order, and (index, track, exception) for failed matches
+    """
+    workers = matcher.max_workers
+    scraped_queue = asyncio.Queue(queue_size)
+    matched_queue = asyncio.Queue(queue_size)
+    stats = {'scraped': 0, 'matched': 0, 'unmatched': 0, 'added': 0}
+    scraped = []
+    errors = []
+
+    async def on_tracks(tracks):
+        # Positions are taken before waiting on the queue, calls may overlap
+        start = stats['scraped']
+        stats['scraped'] += len(tracks)
+        scraped.extend(tracks)
+        for position, track in enumerate(tracks, start):
+            await scraped_queue.put((position, track))
+
+    async def scrape_stage():
+        try:
+            await produce(on_tracks)
+        finally:
+            for _ in range(workers):
+                await scraped_queue.put(_DONE)
+
+    async def match_stage():
+        while True:
+            item = await scraped_queue.get()
+            if item is _DONE:
+                await matched_queue.put(_DONE)
+                return
+            position, track = item
+            try:
+                match = await asyncio.to_thread(matcher.resolve, track)
+            except Exception as e:
+                errors.append((position, track, e))
+                match = None
+            stats['matched' if match is not None else 'unmatched'] += 1
+            await matched_queue.put((position, match))
+
+    async def add_stage():
+        # Matches arrive out of order, release them to batches in playlist order
+        pending = {}
+        next_position = 0
+        batch = []
+        finished = 0
+        while finished < workers:
+            item = await matched_queue.get()
+            if item is _DONE:
+                finished += 1
+                continue
+            position, match = item
+            pending[position] = match
+            while next_position in pending:
+                match = pending.pop(next_position)
+                next_position += 1
+                if match is not None:
+                    batch.append(match)
+                if len(batch) >= batch_size:
+                    stats['added'] += await asyncio.to_thread(add_batch, batch)
+                    batch = []
+        if batch:
+            stats['added'] += await asyncio.to_thread(add_batch, batch)
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            print(
+                f"scraped {stats['scraped']} | matched {stats['matched']} "
+                f"(not found {stats['unmatched']}) | added {stats['added']} | "
+                f"queued {scraped_queue.qsize()}/{matched_queue.qsize()}"
+            )
+
+    reporter = asyncio.create_task(report_progress())
+    stages = [asyncio.create_task(scrape_stage())]
+    stages += [asyncio.create_task(match_stage()) for _ in range(workers)]
+    stages.append(asyncio.create_task(add_stage()))
+    try:
+        # A failed stage would leave the others blocked on its queue, stop them all
+        done, pending = await asyncio.wait(stages, return_when=asyncio.FIRST_EXCEPTION)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+    finally:
+        reporter.cancel()
+    return stats, scraped, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scrape a Spotify playlist and add it to Qobuz as a streaming pipeline.")
+    parser.add_argument("--playlist", help="Name of the SPOTIFY_PLAYLIST_MAP entry, defaults to the first one")
+    parser.add_argument("--env", default=".env", help="Settings file, defaults to .env")
+    args = parser.parse_args()
+
+    settings = load_settings(args.env)
+    spotify_discover.configure(settings)
+    if not settings.playlist_map:
+        print("No playlists configured. Please set SPOTIFY_PLAYLIST_MAP.")
+        return
+    name = args.playlist or next(iter(settings.playlist_map))
+    playlist_id = settings.playlist_map.get(name)
+    if playlist_id is None:
+        print(f"Playlist '{name}' is not in SPOTIFY_PLAYLIST_MAP.")
+        return
+
+    if not settings.has_qobuz_credentials:
+        print("No Qobuz credentials found in .env file. Please set QOBUZ_USER and QOBUZ_PASS.")
+        return
+    user = login(settings.qobuz_user, settings.qobuz_pass, settings.credentials_cache)
+    if user is None:
+        print("Failed to log in to Qobuz.")
+        return
+
+    playlist = find_or_create_playlist(user, settings.sync_playlist)
+    if playlist is None:
+        return
+    # Never add a track twice, whether it was already in the playlist or repeats in this run
+    present = {track_id for track_id, _ in get_playlist_entries(user, playlist)}
+
+    def add_batch(batch):
+        new = [track for track in batch if track.id not in present]
+        present.update(track.id for track in new)
+        not_added = add_tracks(user, playlist, new)
+        return len(new) - len(not_added)
+
+    matcher = get_matcher(settings)
+    qobuz_control.set_controller(matcher.controller)
+    if settings.favorites_index:
+        matcher.favorites = load_favorites_index(user, settings.favorites_index, matcher.catalog)
+    client = spotify_discover.get_spotify_api_client() if settings.extraction_mode == 'api' else None
+
+    async def produce(on_tracks):
+        await spotify_discover.get_playlist_tracks(playlist_id, client=client, on_tracks=on_tracks)
+
+    stats, scraped, errors = asyncio.run(run_pipeline(produce, matcher, add_batch))
+    spotify_discover.save_tracks_to_json(scraped, f"{name}_tracks.json")
+    spotify_discover.save_snapshot(name, scraped)
+    print_match_errors(errors)
+    print(
+        f"Done: scraped {stats['scraped']}, matched {stats['matched']}, "
+        f"not found {stats['unmatched']}, added {stats['added']} to '{playlist.name}'."
+    )
+    tracing.export(settings.trace_jsonl, settings.trace_prometheus)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import json
+import os
+
+import qobuz
+
+import qobuz_control
+
+CREDENTIALS_FILE = ".qobuz_credentials.json"
+
+
+def _load_credentials(path):
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_credentials(path, app_id, secret, user):
+    if not path:
+        return
+    credentials = {
+        "app_id": app_id,
+        "secret": secret,
+        "username": user.username,
+        "user_auth_token": user.auth_token,
+        "user_id": user.id,
+        "credential_id": user.credential_id,
+        "device_id": user.device_id,
+    }
+    # The file holds a session token, keep it readable by the owner only
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(credentials, f)
+
+
+def _user_from_token(credentials):
+    """Rebuild a qobuz.User from a cached session without logging in again."""
+    user = qobuz.User.__new__(qobuz.User)
+    user.username = credentials["username"]
+    user.auth_token = credentials["user_auth_token"]
+    user.id = credentials.get("user_id")
+    user.credential_id = credentials.get("credential_id")
+    user.device_id = credentials.get("device_id")
+    return user
+
+
+def session_is_valid(user):
+    """One cheap authenticated request, fails when the app ID or token is rejected."""
+    try:
+        qobuz.api.request(
+            "favorite/getUserFavorites", type="tracks", limit=1, offset=0,
+            user_auth_token=user.auth_token,
+        )
+        return True
+    except Exception:
+        return False
+
+
+def _probe_bundle(username, password):
+    """Scrape the web player bundle and try each secret until a login succeeds."""
+    from qobuz_dl.bundle import Bundle
+
+    bundle = Bundle()
+    app_id = bundle.get_app_id()
+    secrets = list(bundle.get_secrets().values())
+    print(f"App ID: {app_id}")
+
+    print("Registering app with Qobuz...")
+    for secret in secrets:
+        try:
+            qobuz.api.register_app(app_id, secret)
+            user = qobuz.User(username, password)
+            return app_id, secret, user
+        except Exception as e:
+            print(f"Failed to register with secret {secret}: {e}")
+    return app_id, None, None
+
+
+def login(username, password, cache_path=CREDENTIALS_FILE):
+    """
+    Log in to Qobuz, reusing cached app credentials and session when possible.
+
+    Tries, in order: the cached session token, a fresh login with the cached
+    app ID and secret, and finally the bundle scrape with secret probing. The
+    working app ID, secret and token are written back to cache_path.
+
+    Parameters
+    ----------
+    username: str
+        Qobuz e-mail or username
+    password: str
+        Qobuz password
+    cache_path: str
+        Credential cache file, an empty value disables the cache
+
+    Returns
+    -------
+    qobuz.User or None
+    """
+    qobuz_control.set_request_timeout()
+    cached = _load_credentials(cache_path)
+    if cached and cached.get("username") == username and cached.get("app_id"):
+        qobuz.api.register_app(cached["app_id"], cached.get("secret"))
+        user = _user_from_token(cached)
+        if session_is_valid(user):
+            print("Reusing cached Qobuz session.")
+            return user
+        try:
+            user = qobuz.User(username, password)
+            _save_credentials(cache_path, cached["app_id"], cached.get("secret"), user)
+            print("Logged in with cached Qobuz app credentials.")
+            return user
+        except Exception as e:
+            print(f"Cached Qobuz app credentials rejected: {e}")
+
+    app_id, secret, user = _probe_bundle(username, password)
+    if user is None:
+        return None
+    _save_credentials(cache_path, app_id, secret, user)
+    print("Successfully logged in!")
+    return user
@@ -0,0 +1,234 @@
+import random
+import re
+import threading
+import time
+
+import requests
+
+import tracing
+
+# Error classes returned by classify_error
+FATAL = "fatal"
+RETRY = "retry"  # transient, not a sign of overload (connection reset, timeout)
+CONGESTION = "congestion"  # the service is shedding load (429, 5xx)
+
+MAX_RETRIES = 4
+REQUEST_TIMEOUT = 30.0  # seconds, a hung request would hold its slot under the limit forever
+BASE_DELAY = 0.5  # seconds, doubled on every retry
+MAX_DELAY = 30.0
+DECREASE_INTERVAL = 1.0  # seconds between two multiplicative decreases
+
+
+def classify_error(e):
+    """
+    Classify an exception raised by a Qobuz API call.
+
+    Returns
+    -------
+    str
+        CONGESTION for 429 and 5xx responses, RETRY for timeouts and
+        connection errors, FATAL for everything else (4xx, bad payloads)
+    """
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        status = e.response.status_code
+        if status == 429 or status >= 500:
+            return CONGESTION
+        if status == 408:
+            return RETRY
+        return FATAL
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return RETRY
+    return FATAL
+
+
+def describe_error(e):
+    """
+    The message of an exception raised by a Qobuz API call, safe to print.
+
+    Request URLs carry app_id and user_auth_token in their query string,
+    it is cut from every URL in the message.
+    """
+    return re.sub(r"(https?://[^\s?]+)\?\S*", r"\1", str(e))
+
+
+def _is_throttled(e):
+    response = getattr(e, "response", None)
+    return isinstance(e, requests.HTTPError) and response is not None and response.status_code == 429
+
+
+class _TimeoutRequests(object):
+    """Stands in for the requests module inside qobuz.api, which sets no timeout."""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    def get(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return requests.get(*args, **kwargs)
+
+    def post(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return requests.post(*args, **kwargs)
+
+
+def set_request_timeout(timeout=REQUEST_TIMEOUT):
+    """
+    Apply timeout (seconds) to every request qobuz.api sends.
+
+    Called by qobuz_auth.login and by entry points that talk to Qobuz
+    without logging in, so it applies whatever was imported first.
+    """
+    import qobuz.api
+
+    qobuz.api.requests = _TimeoutRequests(timeout)
+
+
+def _retry_after(e):
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveController(object):
+    """Client-side concurrency control and retries for Qobuz API calls.
+
+    Requests in flight are capped by a limit adjusted with AIMD: it grows by
+    1/limit on every success and is halved when Qobuz answers 429 or 5xx.
+    Retryable failures are retried with jittered exponential backoff, fatal
+    ones are raised straight away.
+
+    Parameters
+    ----------
+    initial_limit: float
+        Requests in flight allowed at start
+    min_limit: int
+        Lower bound of the limit
+    max_limit: int
+        Upper bound of the limit
+    limiter: TokenBucket, optional
+        Rate limit applied to every attempt
+    max_retries: int
+        Retries after the first attempt
+    """
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=32, limiter=None,
+                 max_retries=MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        self.stats = {"calls": 0, "retries": 0, "congestion": 0, "failures": 0}
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def _release(self, outcome):
+        with self._cond:
+            self.in_flight -= 1
+            if outcome is None:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            elif outcome == CONGESTION:
+                self.stats["congestion"] += 1
+                tracing.count("qobuz_congestion")
+                now = time.monotonic()
+                # Failures of requests sent before the last decrease are not new signal
+                if now - self._last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self._last_decrease = now
+            self._cond.notify_all()
+
+    def backoff(self, attempt, e=None):
+        """Seconds to wait before retry number attempt (0-based), full jitter."""
+        retry_after = _retry_after(e) if e is not None else None
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) under the concurrency limit, retrying transient errors."""
+        return self._call(func, args, kwargs, idempotent=True)
+
+    def call_write(self, func, *args, **kwargs):
+        """
+        Like call, for requests that change something on Qobuz.
+
+        Only 429 answers are retried, the request was refused before doing
+        anything. After a 5xx, a timeout or a dropped connection the write
+        may have been applied, so the error is raised and the caller checks
+        the server state before sending it again.
+        """
+        return self._call(func, args, kwargs, idempotent=False)
+
+    def _call(self, func, args, kwargs, idempotent):
+        attempt = 0
+        while True:
+            self._acquire()
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                kind = classify_error(e)
+                self._release(kind)
+                retryable = kind != FATAL and (idempotent or _is_throttled(e))
+                if not retryable or attempt >= self.max_retries:
+                    with self._cond:
+                        self.stats["failures"] += 1
+                    tracing.count("qobuz_failures")
+                    raise
+                with self._cond:
+                    self.stats["retries"] += 1
+                tracing.count("qobuz_retries")
+                time.sleep(self.backoff(attempt, e))
+                attempt += 1
+                continue
+            self._release(None)
+            with self._cond:
+                self.stats["calls"] += 1
+            return result
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_controller():
+    """The controller shared by every Qobuz call in this process."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = AdaptiveController()
+        return _default
+
+
+def set_controller(controller):
+    """Replace the shared controller, e.g. with one configured from .env."""
+    global _default
+    with _default_lock:
+        _default = controller
+
+
+def call(func, *args, **kwargs):
+    """Call func through the shared controller."""
+    return get_controller().call(func, *args, **kwargs)
+
+
+def call_write(func, *args, **kwargs):
+    """Call a non-idempotent func through the shared controller."""
+    return get_controller().call_write(func, *args, **kwargs)
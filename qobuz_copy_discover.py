@@ -1,13 +1,41 @@
 import qobuz
-from qobuz_dl.bundle import Bundle
-import dotenv
+from qobuz_auth import login
 import asyncio
 import json
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from qobuz_matcher import QobuzMatcher, TokenBucket, MAX_WORKERS, RATE_LIMIT, SEARCH_CANDIDATES
+from qobuz_sync import add_tracks, find_playlist, sync_playlist
+import qobuz_control
+from qobuz_control import AdaptiveController, MAX_RETRIES
+from match_cache import MatchCache, DEFAULT_MAX_ENTRIES, DEFAULT_NEGATIVE_TTL
+from favorites_index import FavoritesIndex
+from catalog_index import CatalogIndex
+from snapshot_store import SnapshotStore, DEFAULT_PATH as SNAPSHOT_PATH
+import tracing
+from settings import load_settings
 
-def get_user_favorites(user, fav_type, raw=False):
+FAVORITE_TYPES = {"tracks": qobuz.Track, "albums": qobuz.Album, "artists": qobuz.Artist}
+FAVORITES_BATCH = 500  # favorite tracks added to the catalog index per transaction
+FAVORITES_PROBE = 50  # newest favorites read to check whether the saved index is current
+CREATE_ATTEMPTS = 3  # playlist creations tried, each failed one is looked up before the next
+
+def _favorites_page(user, fav_type, limit, offset):
+    return qobuz_control.call(
+        qobuz.api.request,
+        "favorite/getUserFavorites",
+        type=fav_type,
+        limit=limit,
+        offset=offset,
+        user_auth_token=user.auth_token,
+    )[fav_type]
+
+def get_user_favorites(user, fav_type, raw=False, index=None, max_workers=4, limit=500):
     """
-    Returns all user favorites
+    Yields all user favorites
+
+    The first page gives the total, the remaining pages are fetched
+    concurrently and yielded in order as they arrive.
 
     Parameters
     ----------
@@ -15,24 +43,45 @@ def get_user_favorites(user, fav_type, raw=False):
         returned by qobuz.User
     fav_type: str
         favorites type: 'tracks', 'albums', 'artists'
-    limi
-    """
-    limit = 500
-    offset = 0
-    favorites = []
-    while True:
-        favs = user.favorites_get(fav_type=fav_type, limit=limit, offset=offset)
-        if raw:
-            if len(favs[fav_type]["items"]) == 0:
-                break
-            for _f in favs[fav_type]["items"]:
-                favorites.append(_f)
-        else:
-            if not favs:
-                break
-            favorites += favs
-        offset += limit
-    return favorites
+    raw: bool
+        yield the raw API items instead of qobuz objects
+    index: FavoritesIndex, optional
+        filled with every favorite track as it is yielded
+    max_workers: int
+        pages fetched at once
+    limit: int
+        items per page
+    """
+    first = _favorites_page(user, fav_type, limit, 0)
+    total = first.get("total", len(first["items"]))
+    offsets = range(limit, total, limit)
+
+    def pages():
+        yield first
+        if offsets:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                yield from pool.map(lambda offset: _favorites_page(user, fav_type, limit, offset), offsets)
+
+    for page in pages():
+        for item in page["items"]:
+            if index is not None and fav_type == "tracks":
+                index.add(item)
+            yield item if raw else FAVORITE_TYPES[fav_type](item)
+
+def load_new_spotify_tracks(path=SNAPSHOT_PATH, playlist="discover_weekly"):
+    """
+    Loads only the tracks of the latest snapshot that no earlier week of the
+    playlist contained, from the snapshot store at path written by spotify_discover.py.
+    Returns no tracks when path is empty, snapshots are disabled.
+    """
+    if not path:
+        print("Snapshots are disabled (SPOTIFY_SNAPSHOT_DB is empty), there are no new tracks to load.")
+        return []
+    store = SnapshotStore(path)
+    try:
+        return store.new_tracks(playlist)
+    finally:
+        store.close()
 
 def load_spotify_tracks(filename="discover_weekly_tracks.json"):
     with open(filename, "r", encoding="utf-8") as f:
@@ -55,18 +104,31 @@ def create_playlist(user, name, description=None, is_public=0, is_collaborative=
     is_collaborative: int, optional
         1 to make the playlist collaborative, 0 otherwise
     """
-    try:
-        playlist = user.playlist_create(
-            name=name,
-            description=description,
-            is_public=is_public,
-            is_collaborative=is_collaborative
-        )
+    for attempt in range(CREATE_ATTEMPTS):
+        try:
+            playlist = qobuz_control.call_write(
+                user.playlist_create,
+                name=name,
+                description=description,
+                is_public=is_public,
+                is_collaborative=is_collaborative
+            )
+        except Exception as e:
+            fatal = qobuz_control.classify_error(e) == qobuz_control.FATAL
+            playlist = None
+            if not fatal:
+                # The create may have gone through before the error, look before sending it again
+                try:
+                    playlist = find_playlist(user, name)
+                except Exception:
+                    pass
+            if playlist is None:
+                if fatal or attempt == CREATE_ATTEMPTS - 1:
+                    print(f"Failed to create playlist '{name}': {qobuz_control.describe_error(e)}")
+                    return None
+                continue
         print(f"Playlist '{name}' created successfully! (ID: {playlist.id})")
         return playlist
-    except Exception as e:
-        print(f"Failed to create playlist '{name}': {e}")
-        return None
 
 
 
@@ -95,55 +157,183 @@ def get_ids_from_json_tracks():
     """
     return asyncio.run(get_ids_from_json_tracks_async())
 
-def get_ids_from_json_tracks(user,tracks):
+def get_ids_from_json_tracks(user, tracks, matcher=None):
     """
-    Loads tracks from spotify_discover.py, searches for them on Qobuz, and returns a list of Qobuz Track objects.
+    Searches Qobuz for tracks loaded from spotify_discover.py.
+
+    Returns (qobuz_tracks, errors): the matched Qobuz Track objects in playlist
+    order, and a list of (index, track, exception) for searches that failed.
     """
-    qobuz_tracks = []
-    for track in tracks:
-        title = track['track']
-        artist = track['artist']
-        try:
-            results = qobuz.Track.search(f"{title} {artist}", limit=1)
-            if results:
-                qobuz_tracks.append(results[0])
-        except Exception as e:
-            print(f"Error searching Qobuz for '{title}' by '{artist}': {e}")
-    return qobuz_tracks
+    if matcher is None:
+        matcher = QobuzMatcher()
+    matches, errors = matcher.match(tracks)
+    qobuz_tracks = [match for match in matches if match is not None]
+    return qobuz_tracks, errors
+
+def load_favorites_index(user, path, catalog=None):
+    """
+    Loads the local favorites index at path, rebuilt from the user's favorite
+    tracks when it is out of date. The saved index is kept when Qobuz reports
+    the same number of favorites and knows every one of the first page.
+    Rebuilt favorites are also added to catalog, when given.
+    """
+    index = FavoritesIndex(path)
+    if len(index):
+        probe = _favorites_page(user, "tracks", FAVORITES_PROBE, 0)
+        if probe.get("total") == len(index) and all(item.get("id") in index for item in probe["items"]):
+            print(f"Favorites index: {len(index)} tracks, up to date")
+            return index
+    index = FavoritesIndex(path, load=False)
+    batch = []
+    for item in get_user_favorites(user, "tracks", raw=True, index=index):
+        if catalog is None:
+            continue
+        batch.append(item)
+        if len(batch) >= FAVORITES_BATCH:
+            catalog.add_many(batch)
+            batch = []
+    if batch:
+        catalog.add_many(batch)
+    index.save()
+    print(f"Favorites index: {len(index)} tracks")
+    return index
 
-def main():
-    bundle = Bundle()
-    app_id = bundle.get_app_id()
-    secrets = "\n".join(bundle.get_secrets().values())
+def get_matcher(settings, favorites=None):
+    """
+    Builds a QobuzMatcher from the match settings of a settings.Settings.
+    An empty match_cache or catalog_index path disables the match cache or
+    the local catalog index.
 
-    print(f"App ID: {app_id}")
-    print(f"Secrets (the first usually works):{secrets}")
+    Pass matcher.controller to qobuz_control.set_controller so every other
+    Qobuz call respects the same rate limit and concurrency limit.
+    """
+    max_workers = settings.match_workers or MAX_WORKERS
+    rate = settings.match_rate if settings.match_rate is not None else RATE_LIMIT
+    controller = AdaptiveController(
+        initial_limit=max_workers,
+        max_limit=max_workers,
+        limiter=TokenBucket(rate),
+        max_retries=settings.max_retries if settings.max_retries is not None else MAX_RETRIES
+    )
+    cache = None
+    if settings.match_cache:
+        cache = MatchCache(
+            settings.match_cache,
+            # 0 is meaningful for both: no eviction, and never trust a "not found"
+            max_entries=settings.match_cache_size if settings.match_cache_size is not None else DEFAULT_MAX_ENTRIES,
+            negative_ttl=(
+                settings.match_negative_ttl if settings.match_negative_ttl is not None else DEFAULT_NEGATIVE_TTL
+            )
+        )
+    catalog = CatalogIndex(settings.catalog_index) if settings.catalog_index else None
+    return QobuzMatcher(
+        max_workers=max_workers,
+        cache=cache,
+        candidates=settings.match_candidates or SEARCH_CANDIDATES,
+        favorites=favorites,
+        controller=controller,
+        catalog=catalog
+    )
 
-    print("Registering app with Qobuz...")
-    secrets_list = secrets.split('\n')
-    for secret in secrets_list:
-        try:
-            qobuz.api.register_app(app_id, secret)
-            user = dotenv.dotenv_values(".env")
-            if user.get("QOBUZ_USER") and user.get("QOBUZ_PASS"):
-                user = qobuz.User(user["QOBUZ_USER"], user["QOBUZ_PASS"])
-            else:
-                print("No Qobuz credentials found in .env file. Please set QOBUZ_USER and QOBUZ_PASS.")
-                return
-            # Attempt to login with the provided credentials
-            print("Successfully logged in!")
-            break  # Exit loop if registration is successful
-        except Exception as e:
-            print(f"Failed to register with secret {secret}: {e}")
-        qobuz.api.register_app(app_id, secrets[0])
+def print_match_errors(errors):
+    for index, track, e in errors:
+        print(f"Error searching Qobuz for '{track['track']}' by '{track['artist']}' (#{index + 1}): {e}")
+
+def find_or_create_playlist(user, target=None, description="Spotify Discover Weekly Copy"):
+    """
+    The user's playlist named (or with the ID) target, created when it does
+    not exist. Without target a new timestamped playlist is created.
+    Returns None when the playlist could not be created.
+    """
+    if target:
+        playlist = find_playlist(user, target)
+        if playlist is not None:
+            return playlist
+        return create_playlist(user, target, description)
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    playlist_name = f"Spotify Discover Weekly {timestamp}"
-    playlist = create_playlist(user, playlist_name, "Spotify Discover Weekly Copy")
-    if playlist:
-        tracks = load_spotify_tracks()
-        qobuz_tracks = get_ids_from_json_tracks(user,tracks)
+    return create_playlist(user, f"Spotify Discover Weekly {timestamp}", description)
+
+def sync_tracks(user, matcher, tracks, target=None, remove_stale=False, new_only=False):
+    """
+    Match tracks on Qobuz and bring a playlist in line with them.
+
+    Parameters
+    ----------
+    user: qobuz.User
+        Authenticated Qobuz user object
+    matcher: QobuzMatcher
+        Matcher used for tracks, see get_matcher
+    tracks: list of dict
+        Track records, as loaded from spotify_discover.py
+    target: str, optional
+        Name or ID of the playlist kept in sync, found or created. Without
+        target, a new timestamped playlist is created and the tracks added to it
+    remove_stale: bool
+        Delete playlist entries that are not in tracks, see sync_playlist
+    new_only: bool
+        tracks are only the new tracks of the week, stale entries are never
+        removed then as earlier weeks' tracks would all look stale
+
+    Returns
+    -------
+    dict
+        Counts of tracks, matched, errors, added and removed tracks, or an
+        error message when the playlist could not be created
+    """
+    playlist = find_or_create_playlist(user, target)
+    if playlist is None:
+        return {"error": f"could not create playlist '{target}'" if target else "could not create playlist"}
+    matches, errors = matcher.match(tracks)
+    print_match_errors(errors)
+    qobuz_tracks = [match for match in matches if match is not None]
+    print(f"Matched {len(qobuz_tracks)} of {len(tracks)} tracks.")
+    summary = {"tracks": len(tracks), "matched": len(qobuz_tracks), "errors": len(errors)}
+    if target:
+        if remove_stale and new_only:
+            print(f"Not removing stale tracks from '{playlist.name}': only the new tracks are synced.")
+            remove_stale = False
+        added, removed = sync_playlist(
+            user, playlist, qobuz_tracks, remove_stale=remove_stale, unresolved=len(errors)
+        )
+        print(f"Synced playlist '{playlist.name}': {added} added, {removed} removed.")
+    else:
         print(f"Adding {len(qobuz_tracks)} tracks to the playlist...")
-        playlist.add_tracks(qobuz_tracks, user)
+        not_added = add_tracks(user, playlist, qobuz_tracks)
+        added, removed = len(qobuz_tracks) - len(not_added), 0
+    summary.update(added=added, removed=removed)
+    return summary
+
+def main(env_path=".env"):
+    settings = load_settings(env_path)
+    if not settings.has_qobuz_credentials:
+        print("No Qobuz credentials found in .env file. Please set QOBUZ_USER and QOBUZ_PASS.")
+        return
+    user = login(settings.qobuz_user, settings.qobuz_pass, settings.credentials_cache)
+    if user is None:
+        print("Failed to log in to Qobuz.")
+        return
+
+    if settings.new_tracks_only:
+        tracks = load_new_spotify_tracks(settings.snapshot_db)
+        print(f"{len(tracks)} tracks are new since earlier weeks.")
+    else:
+        tracks = load_spotify_tracks()
+    matcher = get_matcher(settings)
+    qobuz_control.set_controller(matcher.controller)
+    if settings.favorites_index:
+        matcher.favorites = load_favorites_index(user, settings.favorites_index, matcher.catalog)
+    # QOBUZ_SYNC_PLAYLIST (name or ID) keeps one playlist up to date instead of creating a new one each run
+    sync_tracks(
+        user, matcher, tracks, target=settings.sync_playlist,
+        remove_stale=settings.remove_stale, new_only=settings.new_tracks_only
+    )
+    if matcher.cache is not None:
+        stats = matcher.cache.stats()
+        print(f"Match cache: {stats['hits']} hits, {stats['misses']} misses")
+    stats = matcher.controller.stats
+    print(f"Qobuz requests: {stats['calls']} ok, {stats['retries']} retried, "
+          f"{stats['congestion']} throttled, {stats['failures']} failed")
+    tracing.export(settings.trace_jsonl, settings.trace_prometheus)
 
 if __name__ == '__main__':
     try:
@@ -1,10 +1,12 @@
 import qobuz
-from qobuz_dl.bundle import Bundle
-import dotenv
+from qobuz_auth import login
 import asyncio
 import json
-from spotify_discover import get_discover_weekly_tracks  # Import the async function
-import datetime
+from qobuz_matcher import QobuzMatcher
+from qobuz_copy_discover import sync_tracks
+import qobuz_control
+import tracing
+from settings import load_settings
 
 def get_user_favorites(user, fav_type, raw=False):
     """
@@ -57,7 +59,8 @@ def create_playlist(user, name, description=None, is_public=0, is_collaborative=
         1 to make the playlist collaborative, 0 otherwise
     """
     try:
-        playlist = user.playlist_create(
+        playlist = qobuz_control.call_write(
+            user.playlist_create,
             name=name,
             description=description,
             is_public=is_public,
@@ -76,6 +79,7 @@ async def get_ids_from_spotify_tracks_async():
     Fetches tracks from Spotify Discover Weekly and searches for them on Qobuz.
     Returns a list of Qobuz track IDs.
     """
+    from spotify_discover import get_discover_weekly_tracks
     tracks = await get_discover_weekly_tracks()
     qobuz_ids = []
     for track in tracks:
@@ -98,54 +102,32 @@ def get_ids_from_spotify_tracks():
 
 def get_ids_from_spotify_tracks(user):
     """
-    Loads tracks from spotify_discover.py, searches for them on Qobuz, and returns a list of Qobuz Track objects.
+    Loads tracks from spotify_discover.py, searches for them on Qobuz, and returns
+    the matched Qobuz Track objects and the (index, track, exception) search errors.
     """
     from spotify_discover import get_discover_weekly_tracks
     tracks = asyncio.run(get_discover_weekly_tracks())
-    qobuz_tracks = []
-    for track in tracks:
-        title = track['track']
-        artist = track['artist']
-        try:
-            results = qobuz.Track.search(f"{title} {artist}", limit=1)
-            if results:
-                qobuz_tracks.append(results[0])
-        except Exception as e:
-            print(f"Error searching Qobuz for '{title}' by '{artist}': {e}")
-    return qobuz_tracks
-
-def main():
-    bundle = Bundle()
-    app_id = bundle.get_app_id()
-    secrets = "\n".join(bundle.get_secrets().values())
+    matches, errors = QobuzMatcher().match(tracks)
+    for index, track, e in errors:
+        print(f"Error searching Qobuz for '{track['track']}' by '{track['artist']}': {e}")
+    return [match for match in matches if match is not None], errors
 
-    print(f"App ID: {app_id}")
-    print(f"Secrets (the first usually works):{secrets}")
+def main(env_path=".env"):
+    from spotify_discover import configure, get_discover_weekly_tracks
+    settings = load_settings(env_path)
+    if not settings.has_qobuz_credentials:
+        print("No Qobuz credentials found in .env file. Please set QOBUZ_USER and QOBUZ_PASS.")
+        return
+    # The playlist map and extraction mode of the scrape come from the same file
+    configure(settings)
+    user = login(settings.qobuz_user, settings.qobuz_pass, settings.credentials_cache)
+    if user is None:
+        print("Failed to log in to Qobuz.")
+        return
 
-    print("Registering app with Qobuz...")
-    secrets_list = secrets.split('\n')
-    for secret in secrets_list:
-        try:
-            qobuz.api.register_app(app_id, secret)
-            user = dotenv.dotenv_values(".env")
-            if user.get("QOBUZ_USER") and user.get("QOBUZ_PASS"):
-                user = qobuz.User(user["QOBUZ_USER"], user["QOBUZ_PASS"])
-            else:
-                print("No Qobuz credentials found in .env file. Please set QOBUZ_USER and QOBUZ_PASS.")
-                return
-            # Attempt to login with the provided credentials
-            print("Successfully logged in!")
-            break  # Exit loop if registration is successful
-        except Exception as e:
-            print(f"Failed to register with secret {secret}: {e}")
-        qobuz.api.register_app(app_id, secrets[0])
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    playlist_name = f"Spotify Discover Weekly {timestamp}"
-    playlist = create_playlist(user, playlist_name, "Spotify Discover Weekly Copy")
-    if playlist:
-        qobuz_tracks = get_ids_from_spotify_tracks(user)
-        print(f"Adding {len(qobuz_tracks)} tracks to the playlist...")
-        playlist.add_tracks(qobuz_tracks, user)
+    tracks = asyncio.run(get_discover_weekly_tracks())
+    sync_tracks(user, QobuzMatcher(), tracks, target=settings.sync_playlist, remove_stale=settings.remove_stale)
+    tracing.export(settings.trace_jsonl, settings.trace_prometheus)
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,195 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import qobuz
+
+import tracing
+from match_scoring import best_candidate
+from qobuz_control import AdaptiveController
+
+# Defaults, overridable from .env (see qobuz_copy_discover.main)
+MAX_WORKERS = 8
+RATE_LIMIT = 10.0  # Qobuz requests per second, 0 disables the limit
+ISRC_CANDIDATES = 5  # results checked for an exact ISRC match
+SEARCH_CANDIDATES = 10  # results scored per free-text search
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket used to rate limit Qobuz requests.
+
+    Parameters
+    ----------
+    rate: float
+        Tokens refilled per second. 0 or less disables limiting
+    capacity: float, optional
+        Largest burst allowed, defaults to one second worth of tokens
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def acquire(self):
+        """Block until a token is available and consume it."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """Consume a token if one is available, returns whether it did without waiting."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class QobuzMatcher(object):
+    """Match Spotify track records against the Qobuz catalog.
+
+    Tracks carrying an ISRC are looked up by ISRC first, free-text search is
+    only the fallback, which scores the top candidates of a single search
+    instead of taking the first hit. Searches run on a bounded thread pool and
+    every request to Qobuz goes through a shared token bucket and an
+    AdaptiveController, which retries throttled and transient failures.
+
+    Parameters
+    ----------
+    max_workers: int
+        Number of searches allowed in flight at once
+    rate: float
+        Qobuz requests per second, 0 disables the limit
+    burst: float, optional
+        Largest burst of requests allowed by the rate limiter
+    cache: MatchCache, optional
+        Cache consulted before searching, cached tracks never hit Qobuz
+    candidates: int
+        Number of search results scored per free-text search
+    favorites: FavoritesIndex, optional
+        Local index of the user's favorite tracks, checked before searching
+    catalog: CatalogIndex, optional
+        Local index of every Qobuz track seen, checked before searching and
+        filled with the search results
+    controller: AdaptiveController, optional
+        Controller for the Qobuz requests, by default one capped at max_workers
+        requests in flight and limited by rate and burst
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, rate=RATE_LIMIT, burst=None, cache=None,
+                 candidates=SEARCH_CANDIDATES, favorites=None, controller=None, catalog=None):
+        self.max_workers = max(1, int(max_workers))
+        if controller is None:
+            controller = AdaptiveController(
+                initial_limit=self.max_workers, max_limit=self.max_workers,
+                limiter=TokenBucket(rate, burst)
+            )
+        self.controller = controller
+        self.limiter = controller.limiter
+        self.cache = cache
+        self.candidates = max(1, int(candidates))
+        self.favorites = favorites
+        self.catalog = catalog
+
+    def search(self, track):
+        """Search Qobuz for one track record, return the best scored hit or None."""
+        with tracing.span("qobuz_search"):
+            results = self.controller.call(
+                qobuz.api.request,
+                "track/search", query=f"{track['track']} {track['artist']}", limit=self.candidates
+            )
+        if self.catalog is not None:
+            self.catalog.add_many(results["tracks"]["items"])
+        item, _ = best_candidate(track, results["tracks"]["items"])
+        return qobuz.Track(item) if item is not None else None
+
+    def search_isrc(self, isrc):
+        """Look up a track by ISRC, return it only on an exact ISRC match."""
+        with tracing.span("qobuz_isrc_search"):
+            results = self.controller.call(qobuz.api.request, "track/search", query=isrc, limit=ISRC_CANDIDATES)
+        if self.catalog is not None:
+            self.catalog.add_many(results["tracks"]["items"])
+        for item in results["tracks"]["items"]:
+            if (item.get("isrc") or "").upper() == isrc.upper():
+                return qobuz.Track(item)
+        return None
+
+    def resolve(self, track):
+        """Resolve one track record to a Qobuz track, or None if not found."""
+        if self.cache is not None:
+            hit, match = self.cache.get(track)
+            tracing.count("cache_hits" if hit else "cache_misses")
+            if hit:
+                if match is None:
+                    tracing.count("unmatched")
+                return match
+        match = None
+        if self.favorites is not None:
+            match = self.favorites.lookup(track)
+            if match is not None:
+                tracing.count("favorites_hits")
+        if match is None and self.catalog is not None:
+            match = self.catalog.lookup(track)
+            if match is not None:
+                tracing.count("catalog_hits")
+        if match is None and track.get('isrc'):
+            match = self.search_isrc(track['isrc'])
+            if match is not None:
+                tracing.count("isrc_hits")
+        if match is None:
+            match = self.search(track)
+        if match is None:
+            tracing.count("unmatched")
+        if self.cache is not None:
+            self.cache.put(track, match)
+        return match
+
+    def match(self, tracks):
+        """
+        Match every track record concurrently.
+
+        Parameters
+        ----------
+        tracks: list of dict
+            Records with 'track' and 'artist' keys, and optionally 'isrc' and
+            'duration_ms', as written by spotify_discover.py
+
+        Returns
+        -------
+        tuple
+            (matches, errors) where matches is aligned with tracks and holds a
+            Qobuz track or None, and errors is a list of (index, track, exception)
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self.resolve, track) for track in tracks]
+
+        matches = []
+        errors = []
+        for index, (track, future) in enumerate(zip(tracks, futures)):
+            try:
+                matches.append(future.result())
+            except Exception as e:
+                matches.append(None)
+                errors.append((index, track, e))
+        return matches, errors
@@ -0,0 +1,222 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from qobuz import api
+
+import qobuz_control
+import tracing
+
+PAGE_SIZE = 500
+CHUNK_SIZE = 50  # track ids per add/delete request
+READ_WORKERS = 4  # playlist pages read at once
+ADD_ROUNDS = 3  # add attempts per chunk, each followed by a read back
+
+
+def find_playlist(user, name_or_id):
+    """
+    Find one of the user's own playlists by ID or by name.
+
+    Parameters
+    ----------
+    user: qobuz.User
+        Authenticated Qobuz user object
+    name_or_id: str
+        Playlist ID, or the exact playlist name
+
+    Returns
+    -------
+    qobuz.Playlist or None
+    """
+    offset = 0
+    while True:
+        playlists = qobuz_control.call(user.playlists_get, filter="owner", limit=PAGE_SIZE, offset=offset)
+        for playlist in playlists:
+            if str(playlist.id) == str(name_or_id) or playlist.name == name_or_id:
+                return playlist
+        if len(playlists) < PAGE_SIZE:
+            return None
+        offset += PAGE_SIZE
+
+
+def _playlist_page(user, playlist, offset, limit=PAGE_SIZE):
+    return qobuz_control.call(
+        api.request,
+        "playlist/get",
+        playlist_id=playlist.id,
+        extra="tracks",
+        limit=limit,
+        offset=offset,
+        user_auth_token=user.auth_token,
+    ).get("tracks", {})
+
+
+def get_playlist_entries(user, playlist, offset=0, max_workers=READ_WORKERS):
+    """
+    Returns the current (track_id, playlist_track_id) pairs of a playlist, in order.
+
+    playlist_track_id identifies the entry itself and is what deleting needs.
+    The first page gives the total, the remaining pages are read concurrently.
+    offset skips the entries before it.
+    """
+    first = _playlist_page(user, playlist, offset)
+    pages = [first]
+    total = first.get("total")
+    if total is not None:
+        offsets = range(offset + PAGE_SIZE, total, PAGE_SIZE)
+        if offsets:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+                pages += pool.map(lambda page_offset: _playlist_page(user, playlist, page_offset), offsets)
+    else:
+        # No total in the answer, read page by page until a short one
+        while len(pages[-1].get("items", [])) == PAGE_SIZE:
+            offset += PAGE_SIZE
+            pages.append(_playlist_page(user, playlist, offset))
+    return [(item["id"], item.get("playlist_track_id")) for page in pages for item in page.get("items", [])]
+
+
+def _playlist_size(user, playlist):
+    tracks = _playlist_page(user, playlist, 0, limit=1)
+    if tracks.get("total") is not None:
+        return tracks["total"]
+    return len(get_playlist_entries(user, playlist))
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _send_chunk(user, playlist, chunk):
+    """Returns the exception of a failed add, None on success."""
+    try:
+        with tracing.span("add_tracks", tracks=len(chunk)):
+            qobuz_control.call_write(playlist.add_tracks, chunk, user, max_elements_per_request=len(chunk))
+    except Exception as e:
+        return e
+    return None
+
+
+def add_tracks(user, playlist, tracks, chunk_size=CHUNK_SIZE, verify=True, rounds=ADD_ROUNDS):
+    """
+    Add tracks to a playlist in chunks and check that every chunk landed.
+
+    Chunks go through the shared Qobuz controller, which retries throttled
+    requests but not the ones that may have been applied. Qobuz appends
+    tracks in the order the requests arrive, so chunks are sent one at a
+    time. With verify, the entries appended by a chunk are read back before
+    the next chunk is sent, and its missing tracks are sent again, for up to
+    rounds attempts: the playlist keeps the order of tracks.
+
+    Parameters
+    ----------
+    user: qobuz.User
+        Authenticated Qobuz user object
+    playlist: qobuz.Playlist
+        Target playlist
+    tracks: list of qobuz.Track
+        Tracks to add, anything with an id attribute
+    chunk_size: int
+        Track ids per request
+    verify: bool
+        Read the playlist back and resend the tracks that are missing
+    rounds: int
+        Attempts per chunk, only 1 without verify as a failed add may have landed
+
+    Returns
+    -------
+    list
+        Tracks that could not be added, empty on success
+    """
+    chunks = _chunks(list(tracks), chunk_size)
+    size = _playlist_size(user, playlist) if verify and chunks else 0
+    not_added = []
+    for chunk in chunks:
+        pending = chunk
+        for attempt in range(max(1, rounds) if verify else 1):
+            if attempt:
+                tracing.count("add_chunks_resent")
+            error = _send_chunk(user, playlist, pending)
+            if error is not None:
+                print(f"Adding {len(pending)} tracks to '{playlist.name}' failed: "
+                      f"{qobuz_control.describe_error(error)}")
+            if not verify:
+                failed = pending if error is not None else []
+            else:
+                # Every entry appended since the last read back confirms one track
+                with tracing.span("add_tracks_verify"):
+                    appended_ids = [track_id for track_id, _ in get_playlist_entries(user, playlist, offset=size)]
+                size += len(appended_ids)
+                appended = Counter(appended_ids)
+                failed = []
+                for track in pending:
+                    if appended[track.id] > 0:
+                        appended[track.id] -= 1
+                    else:
+                        failed.append(track)
+            tracing.count("tracks_added", len(pending) - len(failed))
+            pending = failed
+            if not pending:
+                break
+        not_added += pending
+    if not_added:
+        print(f"{len(not_added)} tracks could not be added to '{playlist.name}'.")
+    return not_added
+
+
+def sync_playlist(user, playlist, tracks, remove_stale=False, chunk_size=CHUNK_SIZE, unresolved=0):
+    """
+    Bring an existing playlist in line with the matched tracks.
+
+    Only tracks missing from the playlist are added. With remove_stale, entries
+    that are no longer in tracks are deleted, unless some source tracks could
+    not be looked up or tracks is empty: their entries would look stale, so
+    nothing is removed then.
+
+    Parameters
+    ----------
+    user: qobuz.User
+        Authenticated Qobuz user object
+    playlist: qobuz.Playlist
+        Target playlist
+    tracks: list of qobuz.Track
+        Matched tracks, anything with an id attribute
+    remove_stale: bool
+        Delete playlist entries that are not in tracks
+    chunk_size: int
+        Track ids sent per request
+    unresolved: int
+        Source tracks whose Qobuz lookup failed, e.g. the match errors
+
+    Returns
+    -------
+    tuple
+        (added, removed) counts
+    """
+    if remove_stale and (unresolved or not tracks):
+        reason = f"{unresolved} tracks could not be looked up" if unresolved else "no tracks were matched"
+        print(f"Not removing stale tracks from '{playlist.name}': {reason}.")
+        remove_stale = False
+    entries = get_playlist_entries(user, playlist)
+    existing_ids = {track_id for track_id, _ in entries}
+    wanted_ids = set()
+    missing = []
+    for track in tracks:
+        if track.id not in existing_ids and track.id not in wanted_ids:
+            missing.append(track)
+        wanted_ids.add(track.id)
+
+    not_added = add_tracks(user, playlist, missing, chunk_size)
+
+    stale = []
+    if remove_stale:
+        stale = [entry_id for track_id, entry_id in entries
+                 if track_id not in wanted_ids and entry_id is not None]
+        for chunk in _chunks(stale, chunk_size):
+            qobuz_control.call(
+                api.request,
+                "playlist/deleteTracks",
+                playlist_id=playlist.id,
+                comma_encoding=False,
+                playlist_track_ids=",".join(map(str, chunk)),
+                user_auth_token=user.auth_token,
+            )
+    return len(missing) - len(not_added), len(stale)
@@ -0,0 +1,121 @@
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+import dotenv
+
+# Defaults repeated from the modules that own them, importing those here
+# would pull the heavy backends into every command
+MATCH_CACHE_PATH = ".qobuz_match_cache.sqlite"
+CATALOG_INDEX_PATH = ".qobuz_catalog_index.sqlite"
+CREDENTIALS_FILE = ".qobuz_credentials.json"
+SNAPSHOT_DB = ".spotify_snapshots.sqlite"
+DAEMON_STATE = ".daemon_state.json"
+
+
+def parse_playlist_map(raw):
+    """Parse a name1:id1,name2:id2 playlist map into a dict."""
+    playlist_map = {}
+    for entry in (raw or "").split(','):
+        if ':' in entry:
+            name, pid = entry.split(':', 1)
+            name = name.strip()
+            pid = pid.strip()
+            if name and pid:
+                playlist_map[name] = pid
+    return playlist_map
+
+
+def _flag(value):
+    return (value or "").lower() in ("1", "true", "yes")
+
+
+def _number(value, cast):
+    return cast(value) if value else None
+
+
+@dataclass
+class Settings:
+    """Configuration read once from the .env file.
+
+    Numeric tuning values are None when unset, the modules using them fall
+    back to their own defaults. Empty paths disable the cache or store they
+    point to.
+    """
+
+    qobuz_user: Optional[str] = None
+    qobuz_pass: Optional[str] = None
+    credentials_cache: str = CREDENTIALS_FILE
+    sync_playlist: Optional[str] = None
+    remove_stale: bool = False
+    new_tracks_only: bool = False
+    match_workers: Optional[int] = None
+    match_rate: Optional[float] = None
+    match_candidates: Optional[int] = None
+    max_retries: Optional[int] = None
+    match_cache: str = MATCH_CACHE_PATH
+    match_cache_size: Optional[int] = None
+    match_negative_ttl: Optional[float] = None
+    catalog_index: str = CATALOG_INDEX_PATH
+    favorites_index: Optional[str] = None
+    snapshot_db: str = SNAPSHOT_DB
+    playlist_map: Dict[str, str] = field(default_factory=dict)
+    spotify_client_id: Optional[str] = field(default=None, repr=False)
+    spotify_client_secret: Optional[str] = field(default=None, repr=False)
+    extraction_mode: str = "api"
+    fallback_mode: str = "dom"
+    playlist_concurrency: Optional[int] = None
+    block_resources: bool = False
+    profile_dir: str = ""
+    debug_screenshot: str = ""
+    daemon_sync_time: Optional[str] = None
+    daemon_port: Optional[int] = None
+    daemon_playlist_template: Optional[str] = None
+    daemon_state: str = DAEMON_STATE
+    trace_jsonl: Optional[str] = None
+    trace_prometheus: Optional[str] = None
+
+    @property
+    def has_qobuz_credentials(self):
+        return bool(self.qobuz_user and self.qobuz_pass)
+
+
+def load_settings(path=".env"):
+    """Read the .env file at path into a Settings."""
+    return settings_from_values(dotenv.dotenv_values(path))
+
+
+def settings_from_values(values):
+    """Parse a mapping of .env names to values into a Settings."""
+    return Settings(
+        qobuz_user=values.get("QOBUZ_USER"),
+        qobuz_pass=values.get("QOBUZ_PASS"),
+        credentials_cache=values.get("QOBUZ_CREDENTIALS_CACHE", CREDENTIALS_FILE),
+        sync_playlist=values.get("QOBUZ_SYNC_PLAYLIST") or None,
+        remove_stale=_flag(values.get("QOBUZ_SYNC_REMOVE_STALE")),
+        new_tracks_only=_flag(values.get("QOBUZ_NEW_TRACKS_ONLY")),
+        match_workers=_number(values.get("QOBUZ_MATCH_WORKERS"), int),
+        match_rate=_number(values.get("QOBUZ_MATCH_RATE"), float),
+        match_candidates=_number(values.get("QOBUZ_MATCH_CANDIDATES"), int),
+        max_retries=_number(values.get("QOBUZ_MAX_RETRIES"), int),
+        match_cache=values.get("QOBUZ_MATCH_CACHE", MATCH_CACHE_PATH),
+        match_cache_size=_number(values.get("QOBUZ_MATCH_CACHE_SIZE"), int),
+        match_negative_ttl=_number(values.get("QOBUZ_MATCH_NEGATIVE_TTL"), float),
+        catalog_index=values.get("QOBUZ_CATALOG_INDEX", CATALOG_INDEX_PATH),
+        favorites_index=values.get("QOBUZ_FAVORITES_INDEX") or None,
+        snapshot_db=values.get("SPOTIFY_SNAPSHOT_DB", SNAPSHOT_DB),
+        playlist_map=parse_playlist_map(values.get("SPOTIFY_PLAYLIST_MAP")),
+        spotify_client_id=values.get("SPOTIFY_CLIENT_ID") or None,
+        spotify_client_secret=values.get("SPOTIFY_CLIENT_SECRET") or None,
+        extraction_mode=values.get("SPOTIFY_EXTRACTION_MODE") or "api",
+        fallback_mode=values.get("SPOTIFY_FALLBACK_MODE") or "dom",
+        playlist_concurrency=_number(values.get("SPOTIFY_PLAYLIST_CONCURRENCY"), int),
+        block_resources=_flag(values.get("SPOTIFY_BLOCK_RESOURCES")),
+        profile_dir=values.get("SPOTIFY_PROFILE_DIR") or "",
+        debug_screenshot=values.get("SPOTIFY_DEBUG_SCREENSHOT") or "",
+        daemon_sync_time=values.get("DAEMON_SYNC_TIME") or None,
+        daemon_port=_number(values.get("DAEMON_PORT"), int),
+        daemon_playlist_template=values.get("DAEMON_SYNC_PLAYLIST_TEMPLATE") or None,
+        daemon_state=values.get("DAEMON_STATE", DAEMON_STATE),
+        trace_jsonl=values.get("TRACE_JSONL") or None,
+        trace_prometheus=values.get("TRACE_PROMETHEUS") or None,
+    )
@@ -0,0 +1,183 @@
+import sqlite3
+import threading
+import time
+
+from normalize import track_key
+
+DEFAULT_PATH = ".spotify_snapshots.sqlite"
+
+
+class SnapshotStore(object):
+    """Append-only history of scraped playlists, one snapshot per playlist and week.
+
+    Titles, artists and match keys are interned in a strings table, so a
+    snapshot row is a handful of integers and repeated tracks cost nothing
+    extra. Rows are never rewritten: saving a week that already has a
+    snapshot keeps the first one.
+
+    Parameters
+    ----------
+    path: str
+        SQLite database file
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS strings (
+                id INTEGER PRIMARY KEY,
+                value TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS snapshots (
+                id INTEGER PRIMARY KEY,
+                playlist TEXT NOT NULL,
+                week TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                UNIQUE (playlist, week)
+            );
+            CREATE TABLE IF NOT EXISTS snapshot_tracks (
+                snapshot_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                key_id INTEGER NOT NULL,
+                title_id INTEGER NOT NULL,
+                artist_id INTEGER NOT NULL,
+                isrc_id INTEGER,
+                duration_ms INTEGER,
+                PRIMARY KEY (snapshot_id, position)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS snapshot_tracks_key ON snapshot_tracks (key_id, snapshot_id);
+            """
+        )
+        self._db.commit()
+        self._strings = {}
+
+    def _intern(self, value):
+        if value is None:
+            return None
+        string_id = self._strings.get(value)
+        if string_id is None:
+            self._db.execute("INSERT OR IGNORE INTO strings (value) VALUES (?)", (value,))
+            string_id = self._db.execute("SELECT id FROM strings WHERE value = ?", (value,)).fetchone()[0]
+            self._strings[value] = string_id
+        return string_id
+
+    def save(self, playlist, week, tracks):
+        """Store the tracks of a playlist for a week, returns the snapshot id.
+
+        An existing snapshot of that week is left as it is and its id returned.
+        An empty tracks list is refused, it can only come from a failed fetch.
+        """
+        if not tracks:
+            raise ValueError(f"Refusing to save an empty snapshot of {playlist} for {week}")
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM snapshots WHERE playlist = ? AND week = ?", (playlist, week)
+            ).fetchone()
+            if row is not None:
+                return row[0]
+            snapshot_id = self._db.execute(
+                "INSERT INTO snapshots (playlist, week, created_at) VALUES (?, ?, ?)",
+                (playlist, week, time.time())
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO snapshot_tracks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        snapshot_id, position, self._intern("\t".join(track_key(track))),
+                        self._intern(track['track']), self._intern(track['artist']),
+                        self._intern(track.get('isrc')), track.get('duration_ms')
+                    )
+                    for position, track in enumerate(tracks)
+                ]
+            )
+            self._db.commit()
+        return snapshot_id
+
+    def weeks(self, playlist):
+        """Weeks with a snapshot of playlist, oldest first."""
+        rows = self._db.execute(
+            "SELECT week FROM snapshots WHERE playlist = ? ORDER BY created_at", (playlist,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _snapshot(self, playlist, week):
+        if week is None:
+            return self._db.execute(
+                "SELECT id, created_at FROM snapshots WHERE playlist = ? ORDER BY created_at DESC LIMIT 1",
+                (playlist,)
+            ).fetchone()
+        return self._db.execute(
+            "SELECT id, created_at FROM snapshots WHERE playlist = ? AND week = ?", (playlist, week)
+        ).fetchone()
+
+    def _select_tracks(self, where, params):
+        rows = self._db.execute(
+            f"""SELECT title.value, artist.value, isrc.value, t.duration_ms
+                FROM snapshot_tracks t
+                JOIN strings title ON title.id = t.title_id
+                JOIN strings artist ON artist.id = t.artist_id
+                LEFT JOIN strings isrc ON isrc.id = t.isrc_id
+                WHERE {where}
+                ORDER BY t.position""",
+            params
+        ).fetchall()
+        tracks = []
+        for title, artist, isrc, duration_ms in rows:
+            track = {'track': title, 'artist': artist}
+            if duration_ms:
+                track['duration_ms'] = duration_ms
+            if isrc:
+                track['isrc'] = isrc
+            tracks.append(track)
+        return tracks
+
+    def tracks(self, playlist, week=None):
+        """Tracks of a snapshot, the latest one when week is None."""
+        with self._lock:
+            snapshot = self._snapshot(playlist, week)
+            if snapshot is None:
+                return []
+            return self._select_tracks("t.snapshot_id = ?", (snapshot[0],))
+
+    def new_tracks(self, playlist, week=None, since="all"):
+        """
+        Tracks of a snapshot that were not in earlier snapshots of the playlist.
+
+        Parameters
+        ----------
+        playlist: str
+            Playlist name
+        week: str, optional
+            Snapshot week, the latest snapshot when None
+        since: str
+            'all' compares against every earlier snapshot, 'last' only against
+            the one right before it
+
+        Returns
+        -------
+        list of dict
+            Track records in playlist order
+        """
+        with self._lock:
+            snapshot = self._snapshot(playlist, week)
+            if snapshot is None:
+                return []
+            snapshot_id, created_at = snapshot
+            if since == "last":
+                earlier = """SELECT id FROM snapshots WHERE playlist = ? AND created_at < ?
+                             ORDER BY created_at DESC LIMIT 1"""
+            else:
+                earlier = "SELECT id FROM snapshots WHERE playlist = ? AND created_at < ?"
+            return self._select_tracks(
+                f"""t.snapshot_id = ? AND t.key_id NOT IN (
+                        SELECT key_id FROM snapshot_tracks WHERE snapshot_id IN ({earlier}))""",
+                (snapshot_id, playlist, created_at)
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,18 +1,16 @@
 import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 import os
 import json
+import re
 import asyncio
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from lxml.html import fromstring
 from playwright.async_api import async_playwright
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Print loaded environment variables for debugging
-print("Loaded SPOTIFY_PLAYLIST_MAP:", os.getenv('SPOTIFY_PLAYLIST_MAP'))
+from settings import parse_playlist_map, settings_from_values
+from snapshot_store import SnapshotStore
+import tracing
 
 # Configuration
 CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
@@ -20,30 +18,221 @@ CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
 REDIRECT_URI = "http://localhost:8080"
 TOKEN_FILE = ".spotify_token"
 
+# How playlist tracks are extracted: 'api' pages through the Spotify Web API,
+# 'dom' scrolls and parses the tracklist rows, 'network' reads the JSON the web
+# player fetches for playlist contents
+EXTRACTION_MODE = os.getenv('SPOTIFY_EXTRACTION_MODE', 'api')
+EXTRACTION_MODES = ('api', 'dom', 'network')
+# Browser mode used when the Web API cannot be used (no credentials, or the
+# playlist is not readable through the API)
+FALLBACK_MODE = os.getenv('SPOTIFY_FALLBACK_MODE', 'dom')
+
+# Only the fields the matcher needs are requested from the Web API
+API_FIELDS = "total,items(track(name,duration_ms,artists(name),external_ids(isrc)))"
+API_PAGE_SIZE = 100
+
+# Number of playlists scraped at once, each in its own browser context
+DEFAULT_PLAYLIST_CONCURRENCY = 4
+PLAYLIST_CONCURRENCY = int(os.getenv('SPOTIFY_PLAYLIST_CONCURRENCY') or DEFAULT_PLAYLIST_CONCURRENCY)
+
+# Abort image, media and font requests, none of them are needed to read tracks
+BLOCK_RESOURCES = os.getenv('SPOTIFY_BLOCK_RESOURCES', '0').lower() in ('1', 'true', 'yes')
+BLOCKED_RESOURCE_TYPES = {'image', 'media', 'font'}
+# page.route() disables the HTTP cache, so with a persistent profile the same
+# resources are blocked by URL pattern through CDP to keep the disk cache warm
+BLOCKED_URL_PATTERNS = [
+    'https://i.scdn.co/*', 'https://mosaic.scdn.co/*', 'https://image-cdn-*.spotifycdn.com/*',
+    'https://p.scdn.co/*', '*.jpg', '*.jpeg', '*.png', '*.webp', '*.gif',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.mp3', '*.mp4',
+]
+# Reuse a browser profile between runs so the player bundle loads from disk cache
+PROFILE_DIR = os.getenv('SPOTIFY_PROFILE_DIR', '')
+
+# Full-page screenshot written after each DOM scrape, for debugging selectors
+DEBUG_SCREENSHOT = os.getenv('SPOTIFY_DEBUG_SCREENSHOT', '')
+
+# Weekly history of every scraped playlist, empty to disable
+SNAPSHOT_DB = os.getenv('SPOTIFY_SNAPSHOT_DB', '.spotify_snapshots.sqlite')
+
 # Support multiple playlist IDs from .env, comma-separated
 PLAYLIST_IDS = os.getenv('SPOTIFY_PLAYLIST_IDS', '').split(',')
 PLAYLIST_IDS = [pid.strip() for pid in PLAYLIST_IDS if pid.strip()]
 
 # Support mapping playlist IDs to names from .env, format: name1:id1,name2:id2
 PLAYLIST_MAP_RAW = os.getenv('SPOTIFY_PLAYLIST_MAP', '')
-PLAYLIST_MAP = {}
-for entry in PLAYLIST_MAP_RAW.split(','):
-    if ':' in entry:
-        name, pid = entry.split(':', 1)
-        name = name.strip()
-        pid = pid.strip()
-        if name and pid:
-            PLAYLIST_MAP[name] = pid
+PLAYLIST_MAP = parse_playlist_map(PLAYLIST_MAP_RAW)
+
+def configure(settings):
+    """
+    Replace the configuration read from the environment at import with a
+    settings.Settings, entry points call it with the settings they loaded.
+    """
+    global CLIENT_ID, CLIENT_SECRET, EXTRACTION_MODE, FALLBACK_MODE, PLAYLIST_CONCURRENCY
+    global BLOCK_RESOURCES, PROFILE_DIR, DEBUG_SCREENSHOT, SNAPSHOT_DB, PLAYLIST_MAP
+    CLIENT_ID = settings.spotify_client_id
+    CLIENT_SECRET = settings.spotify_client_secret
+    EXTRACTION_MODE = settings.extraction_mode
+    FALLBACK_MODE = settings.fallback_mode
+    PLAYLIST_CONCURRENCY = settings.playlist_concurrency or DEFAULT_PLAYLIST_CONCURRENCY
+    BLOCK_RESOURCES = settings.block_resources
+    PROFILE_DIR = settings.profile_dir
+    DEBUG_SCREENSHOT = settings.debug_screenshot
+    SNAPSHOT_DB = settings.snapshot_db
+    PLAYLIST_MAP = dict(settings.playlist_map)
 
 def get_playlist_url(playlist_id):
     return f"https://open.spotify.com/playlist/{playlist_id}"
 
-async def fetch_playlist_content(url):
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context()  # Create an incognito browser context
-        page = await context.new_page()
-        await page.goto(url, wait_until='networkidle')
+# Spotify virtualizes the tracklist: rows that scroll out of view are removed
+# from the DOM. Collect every rendered row keyed by its aria-rowindex (falling
+# back to the track link) so rows can be harvested on each scroll step.
+HARVEST_ROWS_JS = '''() => {
+    const rows = {};
+    for (const row of document.querySelectorAll('div[data-testid="tracklist-row"]')) {
+        const indexed = row.closest('[aria-rowindex]');
+        const link = row.querySelector('a[data-testid="internal-track-link"]');
+        const key = indexed ? indexed.getAttribute('aria-rowindex') : (link ? link.getAttribute('href') : null);
+        if (key !== null) rows[key] = row.outerHTML;
+    }
+    return rows;
+}'''
+
+# The same harvest reduced in the page to [title, [artists], href, rowindex,
+# duration text] per row, so neither HTML nor a second DOM is built in Python
+EXTRACT_ROWS_JS = '''() => {
+    const durationPattern = /^(?:\\d+:)?\\d{1,2}:\\d{2}$/;
+    const rows = {};
+    for (const row of document.querySelectorAll('div[data-testid="tracklist-row"]')) {
+        const indexed = row.closest('[aria-rowindex]');
+        const link = row.querySelector('a[data-testid="internal-track-link"]');
+        const href = link ? link.getAttribute('href') : null;
+        const rowindex = indexed ? indexed.getAttribute('aria-rowindex') : null;
+        const key = rowindex !== null ? rowindex : href;
+        if (key === null) continue;
+        const title = link ? link.querySelector(':scope > div') : null;
+        const artists = Array.from(row.querySelectorAll('a[href*="/artist/"]'), a => a.textContent);
+        // The duration is the last m:ss text in the row
+        let duration = null;
+        for (const div of row.querySelectorAll('div')) {
+            for (const node of div.childNodes) {
+                if (node.nodeType === Node.TEXT_NODE && durationPattern.test(node.nodeValue.trim())) {
+                    duration = node.nodeValue;
+                }
+            }
+        }
+        rows[key] = [title ? title.textContent : null, artists, href, rowindex, duration];
+    }
+    return rows;
+}'''
+
+# The tracklist grid declares its size, including the header row
+DECLARED_TRACK_COUNT_JS = '''() => {
+    const grid = document.querySelector('[data-testid="playlist-tracklist"][aria-rowcount], div[role="grid"][aria-rowcount]');
+    return grid ? parseInt(grid.getAttribute('aria-rowcount'), 10) - 1 : null;
+}'''
+
+def _row_sort_key(key):
+    return (0, int(key)) if key.isdigit() else (1, key)
+
+async def launch_browser(p):
+    """
+    Launch Chromium. With SPOTIFY_PROFILE_DIR set this returns the persistent
+    BrowserContext for that profile instead of a Browser.
+    """
+    with tracing.span("browser_launch", persistent=bool(PROFILE_DIR)):
+        if PROFILE_DIR:
+            return await p.chromium.launch_persistent_context(PROFILE_DIR, headless=True)
+        return await p.chromium.launch(headless=True)
+
+async def _abort_heavy_resources(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def open_playlist_page(browser):
+    """
+    Open a page to scrape one playlist.
+
+    A Browser gets a fresh incognito context per page, the persistent context
+    from launch_browser is shared. Returns (page, owner), close owner when done.
+    """
+    if hasattr(browser, 'new_context'):
+        owner = await browser.new_context()
+        page = await owner.new_page()
+    else:
+        page = await browser.new_page()
+        owner = page
+    if BLOCK_RESOURCES:
+        if PROFILE_DIR:
+            cdp = await page.context.new_cdp_session(page)
+            await cdp.send('Network.enable')
+            await cdp.send('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+        else:
+            await page.route('**/*', _abort_heavy_resources)
+    return page, owner
+
+async def wait_for_first_row(page, timeout=30000):
+    """Wait until the first tracklist row renders, instead of waiting for network idle."""
+    started = asyncio.get_running_loop().time()
+    await page.wait_for_selector('div[data-testid="tracklist-row"]', timeout=timeout)
+    print(f"First track row after {asyncio.get_running_loop().time() - started:.2f}s")
+
+def _html_row_ready(row):
+    """True when a HARVEST_ROWS_JS row has rendered its title and artists."""
+    element = fromstring(row)
+    return bool(
+        element.xpath('.//a[@data-testid="internal-track-link"]/div/text()')
+        and element.xpath('.//a[contains(@href, "/artist/")]/text()')
+    )
+
+def _extracted_row_ready(row):
+    """True when an EXTRACT_ROWS_JS row has rendered its title and artists."""
+    return bool(row[0] and row[1])
+
+async def _harvest_rows(url, browser, harvest_js, row_ready, on_rows=None):
+    """
+    Scroll the playlist, evaluating harvest_js after every step, and return
+    the harvested rows in playlist order.
+
+    A row can be harvested before it has rendered, row_ready tells whether it
+    has. Only ready rows count towards the declared total, and a row is kept
+    from its first ready harvest on. on_rows, an optional coroutine function,
+    is called with the rows that became ready after every scroll step.
+    """
+    if browser is None:
+        async with async_playwright() as p:
+            browser = await launch_browser(p)
+            try:
+                return await _harvest_rows(url, browser, harvest_js, row_ready, on_rows)
+            finally:
+                await browser.close()
+
+    harvested = {}
+    ready = set()
+    emitted = set()
+
+    def merge(rows):
+        for key, row in rows.items():
+            if key in ready:
+                continue
+            harvested[key] = row
+            if row_ready(row):
+                ready.add(key)
+
+    async def emit_new_rows():
+        if on_rows is None:
+            return
+        new_keys = sorted(ready - emitted, key=_row_sort_key)
+        if new_keys:
+            emitted.update(new_keys)
+            await on_rows([harvested[key] for key in new_keys])
+
+    page, owner = await open_playlist_page(browser)
+    try:
+        with tracing.span("page_goto", url=url):
+            await page.goto(url, wait_until='domcontentloaded')
+            await wait_for_first_row(page)
         # Correct scroll container selector - verify this matches Spotify's layout
         scroll_container = '.main-view-container'
         await page.wait_for_selector(scroll_container, state='attached')
@@ -59,49 +248,120 @@ async def fetch_playlist_content(url):
         target_y = box['y'] + box['height'] * 0.75
         await page.mouse.move(target_x, target_y)
 
-        prev_scroll = 0
-        current_scroll = 0
+        declared_count = await page.evaluate(DECLARED_TRACK_COUNT_JS)
+        merge(await page.evaluate(harvest_js))
+        await emit_new_rows()
+        current_scroll = await page.evaluate('(element) => element.scrollTop', element)
         max_attempts = 50
         threshold = 100  # Pixel threshold for considering bottom reached
 
         for _ in range(max_attempts):
-            # Track previous state
-            prev_track_count = len(await page.query_selector_all('div[data-testid="tracklist-row"]'))
+            if declared_count and len(ready) >= declared_count:
+                break  # Every declared row has been harvested
+
             prev_scroll = current_scroll
+            prev_ready = len(ready)
 
-            # Perform scroll
-            await page.mouse.wheel(0, scroll_distance)
-            # Wait for content load with shorter timeout
-            try:
-                await page.wait_for_function(
-                    f'''() => {{
-                        const container = document.querySelector('{scroll_container}');
-                        return container.scrollTop > {prev_scroll};
-                    }}''',
-                    timeout=2000
-                )
-            except Exception:
-                pass
-
-            # Get updated metrics
-            current_scroll = await page.evaluate('(element) => element.scrollTop', element)
-            total_height = await page.evaluate('(element) => element.scrollHeight', element)
-            new_track_count = len(await page.query_selector_all('div[data-testid="tracklist-row"]'))
+            with tracing.span("scroll"):
+                # Perform scroll and wait until the list has moved, no fixed sleeps
+                await page.mouse.wheel(0, scroll_distance)
+                try:
+                    await page.wait_for_function(
+                        f'''() => {{
+                            const container = document.querySelector('{scroll_container}');
+                            return container.scrollTop > {prev_scroll};
+                        }}''',
+                        timeout=2000
+                    )
+                except Exception:
+                    pass
+
+                merge(await page.evaluate(harvest_js))
+                await emit_new_rows()
+                current_scroll = await page.evaluate('(element) => element.scrollTop', element)
+                total_height = await page.evaluate('(element) => element.scrollHeight', element)
 
             # Check termination conditions
             if (current_scroll + client_height + threshold) >= total_height:
+                merge(await page.evaluate(harvest_js))
+                await emit_new_rows()
                 break
-            if new_track_count == prev_track_count and abs(current_scroll - prev_scroll) < 50:
+            if len(ready) == prev_ready and abs(current_scroll - prev_scroll) < 50:
                 break  # No new content and minimal scrolling
 
-            await page.wait_for_timeout(500)  # Additional short delay
+        print(f"Harvested {len(ready)} rows (playlist declares {declared_count}).")
+        tracing.count("rows_harvested", len(ready))
+        if DEBUG_SCREENSHOT:
+            await page.screenshot(path=DEBUG_SCREENSHOT)
+    finally:
+        await owner.close()
+    return [harvested[key] for key in sorted(harvested, key=_row_sort_key)]
+
+async def fetch_playlist_content(url, browser=None, on_tracks=None):
+    """
+    Scroll the playlist and return the harvested tracklist rows as HTML.
+
+    Only for callers that need the markup, get_playlist_tracks uses the
+    lighter extract_playlist_tracks. on_tracks, an optional coroutine
+    function, is called with the tracks of newly harvested rows after every
+    scroll step.
+    """
+    async def on_rows(rows):
+        await on_tracks(scrape_playlist_tracks("<div>" + "".join(rows) + "</div>"))
 
-        await page.screenshot(path="playlist_screenshot.png")
-        content = await page.content()
-        await browser.close()
-        return content
+    rows = await _harvest_rows(
+        url, browser, HARVEST_ROWS_JS, _html_row_ready, on_rows if on_tracks is not None else None
+    )
+    return "<div>" + "".join(rows) + "</div>"
+
+def tracks_from_rows(rows):
+    """Track records from EXTRACT_ROWS_JS rows, the same records scrape_playlist_tracks builds."""
+    tracks = []
+    for title, artists, _, _, duration in rows:
+        if not title or not artists:
+            continue
+        track = {
+            'track': title,
+            'artist': ", ".join(artists)
+        }
+        duration_ms = parse_duration_ms(duration) if duration else None
+        if duration_ms:
+            track['duration_ms'] = duration_ms
+        tracks.append(track)
+    return tracks
+
+async def extract_playlist_tracks(url, browser=None, on_tracks=None):
+    """
+    Scroll the playlist and return its tracks, reading each row in the page.
+
+    on_tracks, an optional coroutine function, is called with the tracks of
+    newly harvested rows after every scroll step.
+    """
+    async def on_rows(rows):
+        await on_tracks(tracks_from_rows(rows))
+
+    rows = await _harvest_rows(
+        url, browser, EXTRACT_ROWS_JS, _extracted_row_ready, on_rows if on_tracks is not None else None
+    )
+    tracks = tracks_from_rows(rows)
+    print(f"Found {len(tracks)} tracks.")
+    return tracks
+
+DURATION_REGEX = re.compile(r'^(?:(\d+):)?(\d{1,2}):(\d{2})$')
+
+def parse_duration_ms(text):
+    """Convert a tracklist duration such as "3:45" or "1:02:03" to milliseconds."""
+    match = DURATION_REGEX.match(text.strip())
+    if not match:
+        return None
+    hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000
 
 def scrape_playlist_tracks(html_content):
+    with tracing.span("html_parse", size=len(html_content)):
+        return _scrape_playlist_tracks(html_content)
+
+def _scrape_playlist_tracks(html_content):
     parser = fromstring(html_content)
     tracks = []
     
@@ -117,13 +377,160 @@ def scrape_playlist_tracks(html_content):
         print(f"Track: {track_name}, Artist: {artist_name}")
         
         if track_name and artist_name:
-            tracks.append({
+            track = {
                 'track': track_name[0],
                 'artist': artist_name
-            })
+            }
+            # The duration is the last m:ss text in the row
+            durations = [parse_duration_ms(t) for t in element.xpath('.//div/text()')]
+            durations = [d for d in durations if d]
+            if durations:
+                track['duration_ms'] = durations[-1]
+            tracks.append(track)
     
     return tracks
 
+def _track_from_api_item(item):
+    """Track record from a Web API style playlist item ({'track': {...}})."""
+    track = item.get('track') or {}
+    if not track.get('name'):
+        return None
+    record = {
+        'track': track['name'],
+        'artist': ", ".join(a['name'] for a in track.get('artists', []) if a.get('name'))
+    }
+    if track.get('duration_ms'):
+        record['duration_ms'] = track['duration_ms']
+    isrc = (track.get('external_ids') or {}).get('isrc')
+    if isrc:
+        record['isrc'] = isrc
+    return record
+
+def _track_from_pathfinder_item(item):
+    """Track record from a web player GraphQL playlist item ({'itemV2': {'data': {...}}})."""
+    data = (item.get('itemV2') or {}).get('data') or {}
+    if not data.get('name'):
+        return None
+    artists = (data.get('artists') or {}).get('items', [])
+    record = {
+        'track': data['name'],
+        'artist': ", ".join(a['profile']['name'] for a in artists if a.get('profile', {}).get('name'))
+    }
+    duration = (data.get('trackDuration') or {}).get('totalMilliseconds')
+    if duration:
+        record['duration_ms'] = duration
+    isrc = (data.get('externalIds') or {}).get('isrc')
+    if isrc:
+        record['isrc'] = isrc
+    return record
+
+def parse_playlist_response(payload):
+    """
+    Extract tracks from a playlist contents response of the Spotify web player.
+
+    Understands both the GraphQL (pathfinder) payload and the Web API
+    /playlists/{id}/tracks paging object.
+
+    Returns
+    -------
+    tuple
+        (total, {position: track record}), total is None when the payload does
+        not describe playlist contents
+    """
+    content = (((payload.get('data') or {}).get('playlistV2') or {}).get('content'))
+    if content is not None:
+        offset = (content.get('pagingInfo') or {}).get('offset', 0)
+        items = {offset + i: _track_from_pathfinder_item(item) for i, item in enumerate(content.get('items', []))}
+        return content.get('totalCount'), {pos: t for pos, t in items.items() if t}
+    if 'items' in payload and 'total' in payload:
+        offset = payload.get('offset', 0)
+        items = {offset + i: _track_from_api_item(item) for i, item in enumerate(payload['items'])}
+        return payload['total'], {pos: t for pos, t in items.items() if t}
+    return None, {}
+
+def _is_playlist_response(response):
+    url = response.url
+    return ('/pathfinder/' in url or '/v1/playlists/' in url) and response.status == 200
+
+async def capture_playlist_tracks(url, browser=None, max_attempts=50, stall_timeout=2.0, on_tracks=None):
+    """
+    Collect playlist tracks from the JSON responses the web player fetches,
+    scrolling only to trigger the next page until the declared total is reached.
+
+    on_tracks, an optional coroutine function, is called with the new tracks
+    of every captured response.
+    """
+    if browser is None:
+        async with async_playwright() as p:
+            browser = await launch_browser(p)
+            try:
+                return await capture_playlist_tracks(url, browser, max_attempts, stall_timeout, on_tracks)
+            finally:
+                await browser.close()
+
+    captured = {}
+    state = {'total': None}
+    page_loaded = asyncio.Event()
+    handlers = set()
+
+    async def handle_response(response):
+        if not _is_playlist_response(response):
+            return
+        try:
+            payload = await response.json()
+        except Exception:
+            return
+        total, tracks = parse_playlist_response(payload)
+        if total is None:
+            return
+        state['total'] = total
+        new_positions = sorted(pos for pos in tracks if pos not in captured)
+        captured.update(tracks)
+        page_loaded.set()
+        if on_tracks is not None and new_positions:
+            await on_tracks([tracks[pos] for pos in new_positions])
+
+    def on_response(response):
+        # Tracked so the capture only returns once every handler has handed
+        # its tracks to on_tracks, which may be waiting on a full queue
+        task = asyncio.ensure_future(handle_response(response))
+        handlers.add(task)
+        task.add_done_callback(handlers.discard)
+
+    page, owner = await open_playlist_page(browser)
+    try:
+        page.on("response", on_response)
+        with tracing.span("page_goto", url=url):
+            await page.goto(url, wait_until='domcontentloaded')
+
+        scroll_container = '.main-view-container'
+        await page.wait_for_selector(scroll_container, state='attached')
+        element = await page.query_selector(scroll_container)
+        box = await element.bounding_box()
+        await page.mouse.move(box['x'] + box['width'] * 0.75, box['y'] + box['height'] * 0.75)
+
+        stalls = 0
+        for _ in range(max_attempts):
+            try:
+                await asyncio.wait_for(page_loaded.wait(), timeout=stall_timeout)
+                stalls = 0
+            except asyncio.TimeoutError:
+                stalls += 1
+                if stalls >= 3:
+                    break  # No more pages are being requested
+            page_loaded.clear()
+            if state['total'] is not None and len(captured) >= state['total']:
+                break
+            # Jump far down the list so the player requests the next page
+            await page.mouse.wheel(0, box['height'] * 4)
+    finally:
+        await owner.close()
+        await asyncio.gather(*handlers)
+
+    print(f"Captured {len(captured)} tracks from network responses (playlist declares {state['total']}).")
+    tracing.count("rows_harvested", len(captured))
+    return [captured[pos] for pos in sorted(captured)]
+
 def get_spotify_client():
     auth_manager = SpotifyOAuth(
         client_id=CLIENT_ID,
@@ -134,6 +541,68 @@ def get_spotify_client():
     )
     return spotipy.Spotify(auth_manager=auth_manager)
 
+def get_spotify_api_client():
+    """
+    Spotify client used to read playlists, or None without SPOTIFY_CLIENT_ID/SECRET.
+
+    Reuses the cached user token from get_spotify_client when there is one,
+    otherwise uses the client credentials flow which needs no login.
+    """
+    if not (CLIENT_ID and CLIENT_SECRET):
+        return None
+    if os.path.exists(TOKEN_FILE):
+        return get_spotify_client()
+    auth_manager = SpotifyClientCredentials(client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
+    return spotipy.Spotify(auth_manager=auth_manager)
+
+async def fetch_playlist_tracks_via_api(client, playlist_id, on_tracks=None):
+    """
+    Page through the playlist items with the Web API.
+
+    The first page gives the total, the remaining pages are fetched
+    concurrently. Returns None when the API cannot be used or returns no
+    tracks, so the caller can fall back to the browser. on_tracks, an optional coroutine function, is
+    called with each page's tracks in playlist order.
+    """
+    if client is None:
+        return None
+
+    def fetch_page(offset):
+        with tracing.span("spotify_api_page", offset=offset):
+            return client.playlist_items(
+                playlist_id, fields=API_FIELDS, limit=API_PAGE_SIZE, offset=offset,
+                additional_types=('track',)
+            )
+
+    tracks = []
+    pending = []
+    try:
+        first = await asyncio.to_thread(fetch_page, 0)
+        offsets = range(API_PAGE_SIZE, first['total'], API_PAGE_SIZE)
+        pending = [asyncio.ensure_future(asyncio.to_thread(fetch_page, offset)) for offset in offsets]
+        # All pages are in flight, wait for them in order so tracks stream out in playlist order
+        for page in [first, *pending]:
+            if not isinstance(page, dict):
+                page = await page
+            page_tracks = [t for t in map(_track_from_api_item, page['items']) if t]
+            tracks += page_tracks
+            if on_tracks is not None and page_tracks:
+                await on_tracks(page_tracks)
+    except Exception as e:
+        for task in pending:
+            task.cancel()
+        if tracks and on_tracks is not None:
+            raise  # Tracks were already handed out, a fallback would repeat them
+        print(f"Spotify Web API unavailable for playlist {playlist_id}: {e}")
+        return None
+    if not tracks:
+        print(f"Spotify Web API returned no tracks for playlist {playlist_id}.")
+        return None
+
+    print(f"Fetched {len(tracks)} tracks from the Spotify Web API.")
+    tracing.count("rows_harvested", len(tracks))
+    return tracks
+
 def get_track_uri(client, track_name, artist_name):
     query = f"track:{track_name} artist:{artist_name}"
     results = client.search(q=query, type='track', limit=1)
@@ -146,32 +615,132 @@ def get_discover_weekly_date():
     last_monday = today - timedelta(days=today.weekday())
     return last_monday.strftime("%d-%m-%y")
 
-async def get_playlist_tracks(playlist_id):
+def _check_mode(mode):
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Unknown extraction mode '{mode}', expected one of {EXTRACTION_MODES}")
+
+async def get_playlist_tracks(playlist_id, mode=None, browser=None, client=None, on_tracks=None):
+    """Tracks of a playlist, raises RuntimeError when none could be read."""
+    mode = mode or EXTRACTION_MODE
+    _check_mode(mode)
+    if mode == 'api':
+        tracks = await fetch_playlist_tracks_via_api(client, playlist_id, on_tracks)
+        if tracks is not None:
+            return tracks
+        mode = FALLBACK_MODE
+        _check_mode(mode)
     url = get_playlist_url(playlist_id)
-    html_content = await fetch_playlist_content(url)
-    return scrape_playlist_tracks(html_content)
+    if mode == 'network':
+        tracks = await capture_playlist_tracks(url, browser, on_tracks=on_tracks)
+    else:
+        tracks = await extract_playlist_tracks(url, browser, on_tracks)
+    if not tracks:
+        # An empty result is a failed scrape, saving it would freeze the week's snapshot
+        raise RuntimeError(f"No tracks found in playlist {playlist_id} ({mode} mode)")
+    return tracks
+
+async def get_discover_weekly_tracks(name="discover_weekly"):
+    """Tracks of the named SPOTIFY_PLAYLIST_MAP entry, the first one when it is missing."""
+    if not PLAYLIST_MAP:
+        raise ValueError("No playlists configured. Please set SPOTIFY_PLAYLIST_MAP.")
+    playlist_id = PLAYLIST_MAP.get(name) or next(iter(PLAYLIST_MAP.values()))
+    client = get_spotify_api_client() if EXTRACTION_MODE == 'api' else None
+    return await get_playlist_tracks(playlist_id, client=client)
 
-async def save_playlist_tracks_to_json(playlist_id, filename):
-    tracks = await get_playlist_tracks(playlist_id)
+def save_tracks_to_json(tracks, filename):
     with open(filename, "w", encoding="utf-8") as f:
         json.dump(tracks, f, ensure_ascii=False, indent=2)
     print(f"Saved {len(tracks)} tracks to {filename}")
 
+def save_snapshot(name, tracks):
+    """Append this week's tracks of a playlist to the snapshot store, empty lists are not saved."""
+    if not SNAPSHOT_DB or not tracks:
+        return
+    store = SnapshotStore(SNAPSHOT_DB)
+    try:
+        store.save(name, get_discover_weekly_date(), tracks)
+    finally:
+        store.close()
+
+async def save_playlist_tracks_to_json(playlist_id, filename, browser=None, client=None):
+    tracks = await get_playlist_tracks(playlist_id, browser=browser, client=client)
+    save_tracks_to_json(tracks, filename)
+
+async def process_all_playlists(playlist_map, concurrency=None, client=None, mode=None,
+                                output_prefix="", browser_factory=None):
+    """
+    Fetch every mapped playlist, with at most `concurrency` playlists in flight.
+
+    In 'api' mode playlists are read through the Web API and the browser is
+    only launched for playlists that need the fallback. Browser scrapes share
+    one browser, each in its own context. Each JSON file is written as soon as
+    its playlist finishes.
+
+    output_prefix is prepended to the JSON file and snapshot names.
+    browser_factory, an optional coroutine function returning a browser owned
+    by the caller, replaces launching (and closing) one here.
+
+    Returns a dict of playlist name to tracks for the playlists that succeeded.
+    """
+    mode = mode or EXTRACTION_MODE
+    _check_mode(mode)
+    scrape_mode = FALLBACK_MODE if mode == 'api' else mode
+    _check_mode(scrape_mode)
+    semaphore = asyncio.Semaphore(concurrency or PLAYLIST_CONCURRENCY)
+    fetched = {}
+
+    async def process(get_browser, name, playlist_id):
+        async with semaphore:
+            tracks = None
+            if mode == 'api':
+                tracks = await fetch_playlist_tracks_via_api(client, playlist_id)
+            if tracks is None:
+                tracks = await get_playlist_tracks(playlist_id, scrape_mode, await get_browser())
+            save_tracks_to_json(tracks, f"{output_prefix}{name}_tracks.json")
+            save_snapshot(f"{output_prefix}{name}", tracks)
+            fetched[name] = tracks
+
+    async def process_all(get_browser):
+        return await asyncio.gather(
+            *(process(get_browser, name, pid) for name, pid in playlist_map.items()),
+            return_exceptions=True
+        )
+
+    if browser_factory is not None:
+        results = await process_all(browser_factory)
+    else:
+        browser_lock = asyncio.Lock()
+        shared = {}
+        async with async_playwright() as p:
+            async def get_browser():
+                async with browser_lock:
+                    if 'browser' not in shared:
+                        shared['browser'] = await launch_browser(p)
+                return shared['browser']
+
+            try:
+                results = await process_all(get_browser)
+            finally:
+                if 'browser' in shared:
+                    await shared['browser'].close()
+    for name, result in zip(playlist_map, results):
+        if isinstance(result, Exception):
+            print(f"Failed to fetch playlist '{name}': {result}")
+    return fetched
+
 def main():
-    # client = get_spotify_client()
-    # # Verify authentication
-    # try:
-    #     client.current_user()
-    # except spotipy.exceptions.SpotifyException:
-    #     print("Authentication failed. Please check your credentials.")
-    #     return
+    # Variables already set in the environment win over the .env file
+    load_dotenv()
+    configure(settings_from_values(os.environ))
+    print("Loaded SPOTIFY_PLAYLIST_MAP:", os.getenv('SPOTIFY_PLAYLIST_MAP'))
+
+    client = get_spotify_api_client() if EXTRACTION_MODE == 'api' else None
+    if EXTRACTION_MODE == 'api' and client is None:
+        print(f"No SPOTIFY_CLIENT_ID/SPOTIFY_CLIENT_SECRET set, using the '{FALLBACK_MODE}' scraper.")
 
     # For each playlist name/id, fetch and save tracks to a mapped JSON file
-    async def process_all_playlists():
-        for name, playlist_id in PLAYLIST_MAP.items():
-            filename = f"{name}_tracks.json"
-            await save_playlist_tracks_to_json(playlist_id, filename)
-    asyncio.run(process_all_playlists())
+    asyncio.run(process_all_playlists(PLAYLIST_MAP, client=client))
+    tracing.export(os.getenv('TRACE_JSONL'), os.getenv('TRACE_PROMETHEUS'))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
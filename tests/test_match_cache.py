@@ -0,0 +1,57 @@
+import types
+
+import pytest
+
+import match_cache
+from match_cache import MatchCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(match_cache, "time", clock)
+    return clock
+
+
+def _track(title):
+    return {"track": title, "artist": "Artist"}
+
+
+def test_not_found_expires_after_the_negative_ttl(tmp_path, clock):
+    cache = MatchCache(str(tmp_path / "cache.sqlite"), negative_ttl=60)
+    cache.put(_track("Gone"), None)
+    assert cache.get(_track("Gone")) == (True, None)
+    clock.now += 61
+    assert cache.get(_track("Gone")) == (False, None)
+    cache.close()
+
+
+def test_found_does_not_expire(tmp_path, clock):
+    cache = MatchCache(str(tmp_path / "cache.sqlite"), negative_ttl=60)
+    cache.put(_track("Home"), types.SimpleNamespace(id=7, title="Home"))
+    clock.now += 3600
+    hit, match = cache.get(_track("Home"))
+    assert hit and match.id == 7
+    cache.close()
+
+
+def test_least_recently_used_is_evicted(tmp_path, clock):
+    cache = MatchCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for i, title in enumerate(["A", "B"]):
+        cache.put(_track(title), types.SimpleNamespace(id=i, title=title))
+        clock.now += 1
+    cache.get(_track("A"))
+    clock.now += 1
+    cache.put(_track("C"), types.SimpleNamespace(id=2, title="C"))
+    assert cache.get(_track("B")) == (False, None)
+    assert cache.get(_track("A"))[0]
+    assert cache.get(_track("C"))[0]
+    cache.close()
@@ -0,0 +1,27 @@
+from match_scoring import best_candidate, score_candidates
+
+
+def _item(item_id, title, performer, duration):
+    return {
+        "id": item_id,
+        "title": title,
+        "performer": {"name": performer},
+        "album": {"artist": {"name": performer}},
+        "duration": duration,
+    }
+
+
+TRACK = {"track": "Home", "artist": "Edward Sharpe & The Magnetic Zeros", "duration_ms": 303000}
+
+
+def test_same_title_wrong_artist_is_rejected():
+    items = [_item(1, "Home", "Michael Bublé", 302)]
+    assert score_candidates(TRACK, items) == [0.0]
+    assert best_candidate(TRACK, items) == (None, 0.0)
+
+
+def test_same_title_right_artist_is_accepted():
+    items = [_item(1, "Home", "Michael Bublé", 302), _item(2, "Home", "Edward Sharpe & The Magnetic Zeros", 303)]
+    item, score = best_candidate(TRACK, items)
+    assert item["id"] == 2
+    assert score > 0.9
@@ -0,0 +1,56 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+from pipeline import run_pipeline
+
+
+class FakeMatcher(object):
+    """Resolves a track to its title after a random delay, None for titles starting with 'x'."""
+
+    max_workers = 4
+
+    def resolve(self, track):
+        time.sleep(random.random() / 100)
+        if track["track"].startswith("x"):
+            return None
+        return track["track"]
+
+
+def _produce(titles, batch):
+    async def produce(on_tracks):
+        tracks = [{"track": title, "artist": "Artist"} for title in titles]
+        # Overlapping calls, as the scraper's row handlers make them
+        await asyncio.gather(*(on_tracks(tracks[i:i + batch]) for i in range(0, len(tracks), batch)))
+    return produce
+
+
+def test_tracks_are_added_in_playlist_order():
+    titles = [f"x{i}" if i % 5 == 0 else str(i) for i in range(60)]
+    added = []
+
+    def add_batch(batch):
+        added.extend(batch)
+        return len(batch)
+
+    stats, scraped, errors = asyncio.run(
+        run_pipeline(_produce(titles, 7), FakeMatcher(), add_batch, batch_size=10, queue_size=5)
+    )
+    assert [track["track"] for track in scraped] == titles
+    assert added == [title for title in titles if not title.startswith("x")]
+    assert stats == {"scraped": 60, "matched": 48, "unmatched": 12, "added": 48}
+    assert errors == []
+
+
+def test_failed_add_stops_every_stage():
+    def add_batch(batch):
+        raise RuntimeError("add failed")
+
+    with pytest.raises(RuntimeError, match="add failed"):
+        asyncio.run(asyncio.wait_for(
+            run_pipeline(_produce([str(i) for i in range(100)], 10), FakeMatcher(), add_batch,
+                         batch_size=5, queue_size=5),
+            timeout=10
+        ))
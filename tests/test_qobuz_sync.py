@@ -0,0 +1,99 @@
+import qobuz
+import pytest
+
+import qobuz_control
+from benchmark import FakeQobuz, make_tracks
+from qobuz_sync import add_tracks
+
+
+class ScriptedQobuz(FakeQobuz):
+    """FakeQobuz whose addTracks answers follow a script.
+
+    Each add request takes the next answer: "ok", "lost" (applied, but
+    answered with 503) or "rejected" (not applied, answered with 503).
+    Requests past the end of the script are answered "ok".
+    """
+
+    def __init__(self, script=()):
+        FakeQobuz.__init__(self, [])
+        self.script = list(script)
+        self.adds = []
+
+    def handle(self, endpoint, params):
+        if endpoint == "playlist/addTracks":
+            self.adds.append(params.get("track_ids"))
+            answer = self.script.pop(0) if self.script else "ok"
+            if answer == "rejected":
+                return 503, {"status": "error"}
+            status, payload = FakeQobuz.handle(self, endpoint, params)
+            if answer == "lost":
+                return 503, {"status": "error"}
+            return status, payload
+        return FakeQobuz.handle(self, endpoint, params)
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """Serve a ScriptedQobuz, returns (fake, user, playlist)."""
+    servers = []
+    monkeypatch.setattr(qobuz.api, "API_URL", qobuz.api.API_URL)
+    monkeypatch.setattr(qobuz.api, "APP_ID", qobuz.api.APP_ID)
+    monkeypatch.setattr(qobuz_control, "_default", qobuz_control.AdaptiveController(max_retries=0))
+
+    def start(script=()):
+        fake = ScriptedQobuz(script)
+        servers.append(fake.serve())
+        user = qobuz.User.__new__(qobuz.User)
+        user.auth_token = "secret-token"
+        playlist = qobuz.Playlist({"id": "1", "name": "Test"})
+        return fake, user, playlist
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def _tracks(count):
+    return [qobuz.Track(FakeQobuz._item(i + 1, track)) for i, track in enumerate(make_tracks(count))]
+
+
+def test_add_keeps_order(serve):
+    fake, user, playlist = serve()
+    tracks = _tracks(7)
+    assert add_tracks(user, playlist, tracks, chunk_size=3) == []
+    assert fake.playlists["1"] == [1, 2, 3, 4, 5, 6, 7]
+    assert len(fake.adds) == 3
+
+
+def test_rejected_chunk_is_resent_before_the_next(serve):
+    fake, user, playlist = serve(["ok", "rejected"])
+    assert add_tracks(user, playlist, _tracks(7), chunk_size=3) == []
+    assert fake.playlists["1"] == [1, 2, 3, 4, 5, 6, 7]
+    assert fake.adds == ["1,2,3", "4,5,6", "4,5,6", "7"]
+
+
+def test_lost_answer_is_not_sent_again(serve):
+    fake, user, playlist = serve(["lost"])
+    assert add_tracks(user, playlist, _tracks(4), chunk_size=2) == []
+    assert fake.playlists["1"] == [1, 2, 3, 4]
+    assert fake.adds == ["1,2", "3,4"]
+
+
+def test_tracks_still_missing_after_every_round_are_returned(serve, capsys):
+    fake, user, playlist = serve(["ok", "rejected", "rejected", "rejected"])
+    tracks = _tracks(6)
+    not_added = add_tracks(user, playlist, tracks, chunk_size=2, rounds=3)
+    assert [track.id for track in not_added] == [3, 4]
+    assert fake.playlists["1"] == [1, 2, 5, 6]
+    # The request URL carries the user token, it must not be printed
+    out = capsys.readouterr().out
+    assert "failed" in out
+    assert "secret-token" not in out
+
+
+def test_without_verify_a_failed_chunk_is_sent_once(serve):
+    fake, user, playlist = serve(["rejected"])
+    not_added = add_tracks(user, playlist, _tracks(4), chunk_size=2, verify=False)
+    assert [track.id for track in not_added] == [1, 2]
+    assert fake.playlists["1"] == [3, 4]
+    assert fake.adds == ["1,2", "3,4"]
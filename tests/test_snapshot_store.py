@@ -0,0 +1,44 @@
+import types
+
+import pytest
+
+import snapshot_store
+from snapshot_store import SnapshotStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Snapshots are ordered by creation time, give every save its own second
+    clock = iter(range(1000))
+    monkeypatch.setattr(snapshot_store, "time", types.SimpleNamespace(time=lambda: next(clock)))
+    store = SnapshotStore(str(tmp_path / "snapshots.sqlite"))
+    yield store
+    store.close()
+
+
+def _track(title, artist="Artist"):
+    return {"track": title, "artist": artist}
+
+
+def test_new_tracks_skips_every_earlier_week(store):
+    store.save("discover_weekly", "2026-01-05", [_track("A"), _track("B")])
+    store.save("discover_weekly", "2026-01-12", [_track("C"), _track("A")])
+    store.save("discover_weekly", "2026-01-19", [_track("D"), _track("B"), _track("C"), _track("E")])
+    assert store.new_tracks("discover_weekly") == [_track("D"), _track("E")]
+    assert store.new_tracks("discover_weekly", since="last") == [_track("D"), _track("B"), _track("E")]
+    assert store.new_tracks("discover_weekly", week="2026-01-12") == [_track("C")]
+
+
+def test_new_tracks_ignores_other_playlists(store):
+    store.save("release_radar", "2026-01-05", [_track("A")])
+    store.save("discover_weekly", "2026-01-12", [_track("A"), _track("B")])
+    assert store.new_tracks("discover_weekly") == [_track("A"), _track("B")]
+    assert store.new_tracks("missing") == []
+
+
+def test_saving_a_week_again_keeps_the_first_snapshot(store):
+    first = store.save("discover_weekly", "2026-01-05", [_track("A")])
+    assert store.save("discover_weekly", "2026-01-05", [_track("B")]) == first
+    assert store.tracks("discover_weekly") == [_track("A")]
+    with pytest.raises(ValueError):
+        store.save("discover_weekly", "2026-01-12", [])
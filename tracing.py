@@ -0,0 +1,127 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+METRIC_PREFIX = "spotify_qobuz"
+MAX_SPANS = 100000  # finished spans kept for the next JSONL export, the oldest are dropped beyond this
+
+
+class Tracer(object):
+    """Timed spans and counters for the scrape, match and add stages.
+
+    Finished spans are kept until the next export, at most MAX_SPANS of
+    them. Per span name totals and the counters accumulate for the life of
+    the process, which is what a Prometheus textfile expects from a
+    long-running daemon.
+    Safe to use from threads and from coroutines.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = collections.deque(maxlen=MAX_SPANS)
+        self._totals = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Time the body of a with block, recording failures by exception type."""
+        started = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            record = {"span": name, "start": round(started, 6), "duration": round(duration, 6)}
+            if attrs:
+                record["attrs"] = attrs
+            if error is not None:
+                record["error"] = error
+            with self._lock:
+                self._spans.append(record)
+                total = self._totals.setdefault(name, [0, 0.0, 0])
+                total[0] += 1
+                total[1] += duration
+                total[2] += error is not None
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """{span name: (count, total seconds, errors)}"""
+        with self._lock:
+            return {name: tuple(total) for name, total in self._totals.items()}
+
+    def export_jsonl(self, path):
+        """Append the spans finished since the last export, then the counters, as JSON lines."""
+        with self._lock:
+            spans, self._spans = self._spans, collections.deque(maxlen=MAX_SPANS)
+            counters = dict(self.counters)
+        with open(path, "a", encoding="utf-8") as f:
+            for record in spans:
+                f.write(json.dumps(record) + "\n")
+            f.write(json.dumps({"counters": counters, "time": round(time.time(), 6)}) + "\n")
+
+    def clear_spans(self):
+        """Drop the finished spans, the totals and counters are kept."""
+        with self._lock:
+            self._spans.clear()
+
+    def export_prometheus(self, path):
+        """Write span totals and counters in the node_exporter textfile format."""
+        lines = [
+            f"# TYPE {METRIC_PREFIX}_span_seconds summary",
+        ]
+        totals = self.summary()
+        for name, (count, seconds, _) in sorted(totals.items()):
+            lines.append(f'{METRIC_PREFIX}_span_seconds_sum{{span="{name}"}} {seconds:.6f}')
+            lines.append(f'{METRIC_PREFIX}_span_seconds_count{{span="{name}"}} {count}')
+        lines.append(f"# TYPE {METRIC_PREFIX}_span_errors_total counter")
+        for name, (_, _, errors) in sorted(totals.items()):
+            lines.append(f'{METRIC_PREFIX}_span_errors_total{{span="{name}"}} {errors}')
+        with self._lock:
+            counters = sorted(self.counters.items())
+        lines.append(f"# TYPE {METRIC_PREFIX}_events_total counter")
+        for name, value in counters:
+            lines.append(f'{METRIC_PREFIX}_events_total{{event="{name}"}} {value}')
+        # The collector may read at any time, never let it see a half written file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+_default = Tracer()
+
+
+def get_tracer():
+    """The tracer shared by every stage in this process."""
+    return _default
+
+
+def span(name, **attrs):
+    """Time a block with the shared tracer."""
+    return _default.span(name, **attrs)
+
+
+def count(name, value=1):
+    """Increment a counter of the shared tracer."""
+    _default.count(name, value)
+
+
+def export(jsonl_path=None, prometheus_path=None):
+    """Export the shared tracer to whichever of the two files is configured."""
+    if jsonl_path:
+        _default.export_jsonl(jsonl_path)
+    else:
+        # Nobody reads the spans, don't let a long-running process collect them
+        _default.clear_spans()
+    if prometheus_path:
+        _default.export_prometheus(prometheus_path)